@@ -1,20 +1,55 @@
 import streamlit as st
+import asyncio
 import json
-from mistralai import Mistral
-from utils import copy_to_clipboard, download_button, display_chat_message
+import itertools
+import operator
+import os
+import re
+import tempfile
+import threading
+import time
+from collections import OrderedDict, deque
+from uuid import uuid4
+from concurrent.futures import ThreadPoolExecutor
+from mistralai import FunctionResultEntry
+from mistralai.models import MistralError
+from utils import display_chat_message, get_cached_agent, get_mistral_client, ORCHESTRATION_HISTORY_LIMIT
+from orchestration_prompts import (
+    EXAMPLES, EXAMPLES_CACHE_PATH, FINANCE_INSTRUCTIONS, WEB_SEARCH_INSTRUCTIONS,
+    CALCULATOR_INSTRUCTIONS, GRAPH_INSTRUCTIONS
+)
 
-def create_orchestration_agents(api_key):
+# Upper bound on simultaneous conversations when running every example prompt at once
+MAX_CONCURRENT_REQUESTS = 5
+
+# Cheap classifier deciding whether a prompt needs the full agent orchestration
+ROUTER_MODEL = "mistral-small-latest"
+ROUTER_PROMPT = (
+    "You route finance questions. Answer YES if answering the user's request needs current market "
+    "data from the web, financial calculations, or charts. Answer NO if a finance expert can answer "
+    "it directly from general knowledge. Reply with YES or NO only."
+)
+
+# Model used by the primary Finance Agent for each latency budget
+MODELS_BY_BUDGET = {
+    "Fast": "mistral-small-latest",
+    "Balanced": "mistral-medium-latest",
+    "Best": "mistral-large-latest"
+}
+
+def create_orchestration_agents(api_key, primary_model=MODELS_BY_BUDGET["Fast"]):
     """Create multiple specialized agents for orchestration"""
-    try:
-        client = Mistral(api_key=api_key)
-        
+    client = get_mistral_client(api_key)
+    
+    with ThreadPoolExecutor(max_workers=4) as executor:
+        # The four agents are independent, so create them concurrently
         # Create the main finance agent that can hand off to other agents
-        finance_agent = client.beta.agents.create(
-            model="mistral-large-latest",
+        finance_future = executor.submit(
+            client.beta.agents.create,
+            model=primary_model,
             name="Finance Agent",
             description="Agent specialized in financial analysis and advice",
-            instructions="You're an expert in finance who can analyze financial data, provide investment advice, "
-                       "and explain financial concepts. You can hand off specialized tasks to other agents.",
+            instructions=FINANCE_INSTRUCTIONS,
             completion_args={
                 "temperature": 0.3,
                 "top_p": 0.95
@@ -22,11 +57,12 @@ def create_orchestration_agents(api_key):
         )
         
         # Create a web search agent for retrieving current information
-        web_search_agent = client.beta.agents.create(
+        web_search_future = executor.submit(
+            client.beta.agents.create,
             model="mistral-medium-latest",
             name="Web Search Agent",
             description="Agent used to search information over the web",
-            instructions="You search the web for the latest financial data and market information.",
+            instructions=WEB_SEARCH_INSTRUCTIONS,
             tools=[{"type": "web_search"}],
             completion_args={
                 "temperature": 0.3,
@@ -35,11 +71,12 @@ def create_orchestration_agents(api_key):
         )
         
         # Create a calculator agent for financial calculations
-        calculator_agent = client.beta.agents.create(
+        calculator_future = executor.submit(
+            client.beta.agents.create,
             model="mistral-medium-latest",
             name="Calculator Agent",
             description="Agent used for complex financial calculations",
-            instructions="You perform financial calculations using the code interpreter.",
+            instructions=CALCULATOR_INSTRUCTIONS,
             tools=[{"type": "code_interpreter"}],
             completion_args={
                 "temperature": 0.3,
@@ -48,11 +85,12 @@ def create_orchestration_agents(api_key):
         )
         
         # Create a graph plotting agent
-        graph_agent = client.beta.agents.create(
+        graph_future = executor.submit(
+            client.beta.agents.create,
             model="mistral-medium-latest",
             name="Graph Agent",
             description="Agent used to create visual representations of financial data",
-            instructions="You create graphs and visualizations of financial data.",
+            instructions=GRAPH_INSTRUCTIONS,
             tools=[{"type": "code_interpreter"}],
             completion_args={
                 "temperature": 0.3,
@@ -60,34 +98,644 @@ def create_orchestration_agents(api_key):
             }
         )
         
-        # Set up handoffs for the finance agent
-        client.beta.agents.update(
-            agent_id=finance_agent.id,
-            handoffs=[web_search_agent.id, calculator_agent.id, graph_agent.id]
-        )
+        finance_agent = finance_future.result()
+        web_search_agent = web_search_future.result()
+        calculator_agent = calculator_future.result()
+        graph_agent = graph_future.result()
         
-        # Set up handoffs for the web search agent
-        client.beta.agents.update(
-            agent_id=web_search_agent.id,
-            handoffs=[calculator_agent.id, graph_agent.id]
-        )
+        # The handoff updates only depend on the agent ids, so run them concurrently too
+        update_futures = [
+            # Set up handoffs for the finance agent
+            executor.submit(
+                client.beta.agents.update,
+                agent_id=finance_agent.id,
+                handoffs=[web_search_agent.id, calculator_agent.id, graph_agent.id]
+            ),
+            # Set up handoffs for the web search agent
+            executor.submit(
+                client.beta.agents.update,
+                agent_id=web_search_agent.id,
+                handoffs=[calculator_agent.id, graph_agent.id]
+            ),
+            # Set up handoffs for the calculator agent
+            executor.submit(
+                client.beta.agents.update,
+                agent_id=calculator_agent.id,
+                handoffs=[graph_agent.id]
+            )
+        ]
+        
+        for future in update_futures:
+            future.result()
+    
+    agent_ids = {
+        "finance": finance_agent.id,
+        "web_search": web_search_agent.id,
+        "calculator": calculator_agent.id,
+        "graph": graph_agent.id
+    }
+    
+    # Reverse lookup used to name the target of each handoff
+    id_to_name = {agent_id: name for name, agent_id in agent_ids.items()}
+    
+    return client, finance_agent, agent_ids, id_to_name
+
+def get_or_create_orchestration_agents(api_key, primary_model=MODELS_BY_BUDGET["Fast"]):
+    """Return the orchestration agents for this API key and model, creating them on first use"""
+    return get_cached_agent(create_orchestration_agents, api_key, "orchestration agents",
+                            empty=(None, None, None, None), primary_model=primary_model)
+
+# Number of trailing output lines shown for a tool execution before "Show full output"
+OUTPUT_PREVIEW_LINES = 40
+
+# Inline base64 images in tool output, either as data URIs or raw PNG payloads
+_BASE64_IMAGE_RE = re.compile(r"data:image/[\w.+-]+;base64,[A-Za-z0-9+/=]+|iVBORw0KGgo[A-Za-z0-9+/=]+")
+
+def preview_tool_output(code_output, max_lines=OUTPUT_PREVIEW_LINES):
+    """Return the last lines of a tool output with base64 images replaced by placeholders"""
+    image_numbers = itertools.count(1)
+    text = _BASE64_IMAGE_RE.sub(lambda match: f"[image {next(image_numbers)}]", code_output)
+    return "\n".join(text.splitlines()[-max_lines:])
+
+# Fields of a tool execution's info that the chat displays
+_TOOL_INFO_FIELDS = ("code", "code_output")
+_get_tool_info_fields = operator.attrgetter(*_TOOL_INFO_FIELDS)
+
+def extract_tool_info(info):
+    """Pick only the code and its output out of a tool execution's info payload"""
+    if isinstance(info, dict):
+        return {field: info[field] for field in _TOOL_INFO_FIELDS if field in info}
+    try:
+        return dict(zip(_TOOL_INFO_FIELDS, _get_tool_info_fields(info)))
+    except AttributeError:
+        return {}
+
+def _handle_response_started(data, turn):
+    """Remember the conversation id so handoff results and follow-up prompts can be sent to it"""
+    turn["conversation_id"] = data.conversation_id
+
+def _handle_message_delta(data, turn):
+    """Append streamed text and refresh the live message"""
+    # Content is either a plain string or a single text chunk
+    if isinstance(data.content, str):
+        turn["text_parts"].append(data.content)
+    elif getattr(data.content, 'type', None) == "text":
+        turn["text_parts"].append(data.content.text)
+    turn["msg_box"].markdown("".join(turn["text_parts"]))
+
+def _handle_handoff(data, turn):
+    """Record a handoff performed by the server"""
+    handoff_agent_id = getattr(data, 'next_agent_id', "")
+    
+    turn["handoffs"].append({
+        "agent_name": turn["id_to_name"].get(handoff_agent_id, "Unknown Agent"),
+        "agent_id": handoff_agent_id
+    })
+
+def _handle_function_call_delta(data, turn):
+    """Accumulate function call arguments; client-side handoffs come back to us as function calls"""
+    tool_call = turn["function_calls"].setdefault(data.tool_call_id, {"name": data.name, "arguments": ""})
+    tool_call["arguments"] += data.arguments
+
+def _handle_tool_execution(data, turn):
+    """Record a finished tool execution, moving its output into the artifact store"""
+    info = extract_tool_info(getattr(data, 'info', None))
+    if "code_output" in info:
+        info["artifact_id"] = store_artifact(info.pop("code_output") or "")
+    
+    turn["tool_executions"].append({
+        "tool_name": getattr(data, 'name', ""),
+        "info": info
+    })
+
+# Stream event type -> handler, each called as handler(event.data, turn)
+STREAM_EVENT_HANDLERS = {
+    "conversation.response.started": _handle_response_started,
+    "message.output.delta": _handle_message_delta,
+    "agent.handoff.done": _handle_handoff,
+    "function.call.delta": _handle_function_call_delta,
+    "tool.execution.done": _handle_tool_execution
+}
+
+def _handoff_target(function_name, turn):
+    """Return the id of the agent a handoff function call transfers to, matched by its name"""
+    normalized = re.sub(r"[^a-z0-9]+", "_", function_name.lower())
+    for agent_id, agent_key in turn["id_to_name"].items():
+        if agent_id != turn["agent_id"] and (agent_id in function_name or agent_key in normalized):
+            return agent_id
+    return None
+
+def _handoff_input(arguments, user_prompt):
+    """Return the text the primary agent passed along with a handoff, or the user prompt without one"""
+    try:
+        args = json.loads(arguments) if arguments else {}
+    except ValueError:
+        return arguments
+    if isinstance(args, dict):
+        args = "\n".join(value for value in args.values() if isinstance(value, str))
+    return args if isinstance(args, str) and args else user_prompt
+
+def collect_client_handoffs(turn):
+    """Turn the function calls of a client-side handoff stream into (tool_call_id, agent_id, inputs) jobs"""
+    announced = [handoff["agent_id"] for handoff in turn["handoffs"]]
+    pending_handoffs = []
+    for i, (tool_call_id, tool_call) in enumerate(turn["function_calls"].items()):
+        # Fall back to the handoff events, which name the target directly, in the same order
+        agent_id = _handoff_target(tool_call["name"], turn) or (announced[i] if i < len(announced) else None)
+        pending_handoffs.append((tool_call_id, agent_id, _handoff_input(tool_call["arguments"], turn["user_prompt"])))
+        
+        if agent_id not in announced:
+            turn["handoffs"].append({
+                "agent_name": turn["id_to_name"].get(agent_id, "Unknown Agent"),
+                "agent_id": agent_id
+            })
+    return pending_handoffs
+
+def needs_orchestration(client, user_prompt):
+    """Ask a small model whether the prompt needs the specialized agents"""
+    decision = client.chat.complete(
+        model=ROUTER_MODEL,
+        messages=[
+            {"role": "system", "content": ROUTER_PROMPT},
+            {"role": "user", "content": user_prompt}
+        ],
+        max_tokens=3,
+        temperature=0
+    )
+    answer = decision.choices[0].message.content
+    # Anything other than a clear NO goes through the orchestration
+    return not (isinstance(answer, str) and answer.strip().upper().startswith("NO"))
+
+def stream_direct_answer(client, model, user_prompt, msg_box):
+    """Answer the prompt with a single streamed completion using the finance instructions"""
+    text_parts = []
+    stream = client.chat.stream(
+        model=model,
+        messages=[
+            {"role": "system", "content": FINANCE_INSTRUCTIONS},
+            {"role": "user", "content": user_prompt}
+        ],
+        temperature=0.3,
+        top_p=0.95
+    )
+    for chunk in stream:
+        delta = chunk.data.choices[0].delta.content
+        if isinstance(delta, str):
+            text_parts.append(delta)
+            msg_box.markdown("".join(text_parts))
+    return "".join(text_parts)
+
+def response_text(response):
+    """Collect the text of the message outputs of a non-streamed conversation response"""
+    text_parts = []
+    for output in response.outputs:
+        if getattr(output, 'type', None) != "message.output":
+            continue
+        if isinstance(output.content, str):
+            text_parts.append(output.content)
+        else:
+            for content_item in output.content:
+                if getattr(content_item, 'type', None) == "text":
+                    text_parts.append(content_item.text)
+    return "".join(text_parts)
+
+# Non-streamed output entry type -> the stream handler that records the same information
+OUTPUT_ENTRY_HANDLERS = {
+    "agent.handoff": _handle_handoff,
+    "tool.execution": _handle_tool_execution
+}
+
+def collect_response_turn(response, id_to_name):
+    """Turn a non-streamed, server-side handoff conversation response into a history entry"""
+    turn = {
+        "id_to_name": id_to_name,
+        "handoff_mode": "server",
+        "handoffs": [],
+        "tool_executions": []
+    }
+    for output in response.outputs:
+        handler = OUTPUT_ENTRY_HANDLERS.get(getattr(output, 'type', None))
+        if handler:
+            handler(output, turn)
+    
+    return {
+        "role": "assistant",
+        "content": response_text(response),
+        "handoffs": turn["handoffs"],
+        "tool_executions": turn["tool_executions"]
+    }
+
+async def run_prompts_concurrently(client, agent_id, prompts):
+    """Start one conversation per prompt, at most MAX_CONCURRENT_REQUESTS at a time"""
+    semaphore = asyncio.Semaphore(MAX_CONCURRENT_REQUESTS)
+    
+    async def run_one(prompt):
+        async with semaphore:
+            return await asyncio.to_thread(
+                client.beta.conversations.start,
+                agent_id=agent_id,
+                inputs=prompt,
+                handoff_execution="server"
+            )
+    
+    # Failures are returned in place so one bad prompt does not discard the others
+    return await asyncio.gather(*(run_one(prompt) for prompt in prompts), return_exceptions=True)
+
+def _start_handoff(client, agent_id, inputs):
+    """Start the conversation of one handed-off agent"""
+    if not agent_id:
+        raise ValueError("no agent matches this handoff")
+    return client.beta.conversations.start(agent_id=agent_id, inputs=inputs)
+
+async def run_handoffs_concurrently(client, pending_handoffs):
+    """Start a conversation with every handed-off agent at once and return the responses in order"""
+    # The sync client runs in worker threads: its pooled connections outlive asyncio.run's event loop
+    # Failures are returned in place so one failed handoff does not discard the others
+    return await asyncio.gather(*(
+        asyncio.to_thread(_start_handoff, client, agent_id, inputs)
+        for _, agent_id, inputs in pending_handoffs
+    ), return_exceptions=True)
+
+@st.cache_data(show_spinner=False)
+def _load_examples_cache(cache_mtime):
+    """Read the precomputed example responses; the mtime argument invalidates stale reads"""
+    with open(EXAMPLES_CACHE_PATH, encoding="utf-8") as f:
+        return json.load(f)
+
+def get_cached_example_response(prompt):
+    """Return the precomputed response for an example prompt, if precompute_examples.py has been run"""
+    if not os.path.exists(EXAMPLES_CACHE_PATH):
+        return None
+    return _load_examples_cache(os.path.getmtime(EXAMPLES_CACHE_PATH)).get(prompt)
+
+# Number of tool outputs kept in the process-wide artifact store across all sessions
+ARTIFACT_STORE_LIMIT = 200
+
+# Large tool outputs live here, keyed by artifact id, so session state only carries the ids
+_ARTIFACT_STORE: "OrderedDict[str, str]" = OrderedDict()
+_ARTIFACT_LOCK = threading.Lock()
+
+def store_artifact(content):
+    """Keep a tool output out of session state and return the id it can be loaded with"""
+    artifact_id = uuid4().hex
+    with _ARTIFACT_LOCK:
+        _ARTIFACT_STORE[artifact_id] = content
+        
+        # Drop the oldest outputs beyond the limit, including those of sessions that have ended
+        while len(_ARTIFACT_STORE) > ARTIFACT_STORE_LIMIT:
+            _ARTIFACT_STORE.popitem(last=False)
+    return artifact_id
+
+def load_tool_output(info):
+    """Return the output of a tool execution, whether stored inline or as an artifact"""
+    if "artifact_id" in info:
+        return _ARTIFACT_STORE.get(info["artifact_id"]) or ""
+    return info.get("code_output") or ""
+
+def _message_artifact_ids(message):
+    """List the artifact ids referenced by a history message"""
+    return [tool["info"]["artifact_id"] for tool in message.get("tool_executions", []) if "artifact_id" in tool["info"]]
+
+def _with_artifacts_inlined(message):
+    """Copy a history message with artifact ids replaced by the outputs they point to"""
+    if not _message_artifact_ids(message):
+        return message
+    
+    tool_executions = []
+    for tool in message["tool_executions"]:
+        info = {key: value for key, value in tool["info"].items() if key != "artifact_id"}
+        if "artifact_id" in tool["info"]:
+            info["code_output"] = load_tool_output(tool["info"])
+        tool_executions.append({**tool, "info": info})
+    return {**message, "tool_executions": tool_executions}
+
+# Per-session orchestration logs, and how long one is kept after its last write
+ORCHESTRATION_LOG_DIR = os.path.join(tempfile.gettempdir(), "mistral_agents_orchestration")
+ORCHESTRATION_LOG_MAX_AGE_SECONDS = 24 * 3600
+
+def _orchestration_log_path():
+    """Return this session's log file, removing logs of sessions that have gone quiet"""
+    if 'orch_log_path' not in st.session_state:
+        os.makedirs(ORCHESTRATION_LOG_DIR, exist_ok=True)
+        
+        # Sessions end without notice, so their logs are removed once they are old enough
+        cutoff = time.time() - ORCHESTRATION_LOG_MAX_AGE_SECONDS
+        for entry in os.scandir(ORCHESTRATION_LOG_DIR):
+            try:
+                if entry.stat().st_mtime < cutoff:
+                    os.remove(entry.path)
+            except OSError:
+                pass
+        
+        st.session_state.orch_log_path = os.path.join(ORCHESTRATION_LOG_DIR, f"orch_{uuid4().hex}.jsonl")
+        st.session_state.orch_log_count = 0
+    return st.session_state.orch_log_path
+
+def append_orchestration_message(message):
+    """Append a message to the on-disk orchestration log and the in-memory display tail"""
+    # A stable key for the message's widgets, assigned once
+    message.setdefault("key", uuid4().hex[:10])
+    
+    # The JSONL log keeps every turn in full; session state only holds the most recent ones
+    with open(_orchestration_log_path(), "a", encoding="utf-8") as f:
+        f.write(json.dumps(_with_artifacts_inlined(message), default=str) + "\n")
+    st.session_state.orch_log_count += 1
+    
+    # Release the artifacts of the message the bounded deque is about to drop
+    history = st.session_state.orchestration_history
+    if history.maxlen is not None and len(history) == history.maxlen:
+        for artifact_id in _message_artifact_ids(history[0]):
+            _ARTIFACT_STORE.pop(artifact_id, None)
+    
+    history.append(message)
+
+def earlier_message_count():
+    """Number of logged messages that have dropped out of the in-memory display tail"""
+    return st.session_state.get('orch_log_count', 0) - len(st.session_state.orchestration_history)
+
+def load_earlier_messages(count):
+    """Read the first count messages back from this session's log"""
+    log_path = st.session_state.get('orch_log_path')
+    if not log_path or not os.path.exists(log_path):
+        return []
+    with open(log_path, encoding="utf-8") as f:
+        return [json.loads(line) for line in itertools.islice(f, count)]
+
+def clear_orchestration_history():
+    """Delete the orchestration log and reset the in-memory display tail"""
+    log_path = st.session_state.pop('orch_log_path', None)
+    st.session_state.pop('orch_log_count', None)
+    if log_path and os.path.exists(log_path):
+        os.remove(log_path)
+    
+    for message in st.session_state.orchestration_history:
+        for artifact_id in _message_artifact_ids(message):
+            _ARTIFACT_STORE.pop(artifact_id, None)
+    
+    st.session_state.orchestration_history = deque(maxlen=ORCHESTRATION_HISTORY_LIMIT)
+    st.session_state.pop('orch_conversation', None)
+
+def render_orchestration_message(message):
+    """Render one orchestration message with its handoffs and tool executions"""
+    is_user = message["role"] == "user"
+    
+    # Display the message
+    display_chat_message(message["content"], is_user, key=message["key"])
+    
+    # Display orchestration details for assistant messages
+    if not is_user:
+        # Show handoffs
+        if "handoffs" in message and message["handoffs"]:
+            with st.expander("Agent Handoffs", expanded=True):
+                for i, handoff in enumerate(message["handoffs"]):
+                    st.markdown(f"**Handoff {i+1}:** Primary Agent → {handoff['agent_name']}")
+                    st.markdown("---")
         
-        # Set up handoffs for the calculator agent
-        client.beta.agents.update(
-            agent_id=calculator_agent.id,
-            handoffs=[graph_agent.id]
+        # Show tool executions
+        if "tool_executions" in message and message["tool_executions"]:
+            with st.expander("Tool Executions", expanded=True):
+                for i, tool in enumerate(message["tool_executions"]):
+                    st.markdown(f"**Tool {i+1}:** {tool['tool_name']}")
+                    
+                    # Show code interpreter executions
+                    if tool["tool_name"] == "code_interpreter" and "code" in tool.get("info", {}):
+                        st.markdown("**Code:**")
+                        st.code(tool["info"]["code"], language="python")
+                        
+                        # Only the tail of long outputs is rendered unless asked for
+                        code_output = load_tool_output(tool["info"])
+                        preview = preview_tool_output(code_output)
+                        
+                        st.markdown("**Output:**")
+                        st.code(preview or "No output")
+                        
+                        if preview != code_output.rstrip("\n") and st.toggle(f"Show full output #{i+1}", key=f"full_{message['key']}_{i}"):
+                            st.code(code_output)
+                    
+                    st.markdown("---")
+
+@st.fragment
+def render_chat():
+    """Render the orchestration history; widgets in here only rerun this fragment"""
+    # Create a chat container with scrolling
+    chat_container = st.container()
+    
+    with chat_container:
+        # Turns beyond the in-memory tail are read back from the log only on request
+        earlier = earlier_message_count()
+        if earlier > 0 and st.toggle(f"Show {earlier} earlier messages", key="show_earlier_orchestration"):
+            for message in load_earlier_messages(earlier):
+                render_orchestration_message(message)
+        
+        for message in st.session_state.orchestration_history:
+            render_orchestration_message(message)
+    
+    # Clear history button
+    if st.session_state.orchestration_history and st.button("Clear History", key="clear_orchestration_history"):
+        clear_orchestration_history()
+        st.rerun()
+
+def run_orchestration(user_prompt, handoff_mode, primary_model, force_orchestration=False):
+    """Send a prompt through the orchestration agents and record the turn in history"""
+    with st.spinner("Preparing orchestration agents..."):
+        client, finance_agent, agent_ids, id_to_name = get_or_create_orchestration_agents(
+            st.session_state.api_key,
+            primary_model=primary_model
         )
         
-        return client, finance_agent, {
-            "finance": finance_agent.id,
-            "web_search": web_search_agent.id,
-            "calculator": calculator_agent.id,
-            "graph": graph_agent.id
+    if not client or not finance_agent or not agent_ids:
+        return
+    
+    # Add the user message to the history
+    if 'orchestration_history' not in st.session_state:
+        st.session_state.orchestration_history = deque(maxlen=ORCHESTRATION_HISTORY_LIMIT)
+    
+    # Add user message to history
+    append_orchestration_message({
+        "role": "user",
+        "content": user_prompt
+    })
+    
+    try:
+        # Stream the conversation with the primary agent so tokens show up as they arrive
+        turn = {
+            "agent_id": finance_agent.id,
+            "id_to_name": id_to_name,
+            "handoff_mode": handoff_mode,
+            "user_prompt": user_prompt,
+            "msg_box": st.empty(),
+            "text_parts": [],
+            "handoffs": [],
+            "tool_executions": [],
+            "function_calls": {},
+            "conversation_id": None
         }
+        msg_box = turn["msg_box"]
+        conversation = st.session_state.get('orch_conversation')
+        
+        # A conversation started by another primary agent (e.g. after a budget change) can't be continued
+        continuing = bool(conversation) and conversation["agent_id"] == finance_agent.id
+        
+        # Simple prompts get a single completion; follow-ups stay in the server-side conversation
+        if not force_orchestration and not continuing:
+            with st.spinner("Checking whether this request needs the specialized agents..."):
+                orchestrate = needs_orchestration(client, user_prompt)
+            
+            if not orchestrate:
+                with st.spinner("Answering directly..."):
+                    primary_response = stream_direct_answer(client, primary_model, user_prompt, msg_box)
+                
+                msg_box.empty()
+                append_orchestration_message({
+                    "role": "assistant",
+                    "content": primary_response,
+                    "handoffs": [],
+                    "tool_executions": []
+                })
+                return
+        
+        with st.spinner("Processing your request with multiple agents... This may take a moment."):
+            # Continue the existing conversation so earlier turns stay on the server
+            stream = None
+            if continuing:
+                try:
+                    stream = client.beta.conversations.append_stream(
+                        conversation_id=conversation["id"],
+                        inputs=user_prompt,
+                        handoff_execution=handoff_mode
+                    )
+                except MistralError:
+                    # The stored conversation expired or is invalid, so start a new one
+                    st.session_state.pop('orch_conversation', None)
+            
+            # Stored again once the turn is done and the conversation is not waiting on us
+            st.session_state.pop('orch_conversation', None)
+            
+            if stream is None:
+                stream = client.beta.conversations.start_stream(
+                    agent_id=finance_agent.id,
+                    inputs=user_prompt,
+                    handoff_execution=handoff_mode
+                )
+            
+            for event in stream:
+                handler = STREAM_EVENT_HANDLERS.get(getattr(event.data, 'type', None))
+                if handler:
+                    handler(event.data, turn)
+        
+        response_parts = turn["text_parts"]
+        handoffs = turn["handoffs"]
+        tool_executions = turn["tool_executions"]
+        pending_handoffs = collect_client_handoffs(turn) if handoff_mode == "client" else []
+        conversation_ready = not turn["function_calls"]
+        
+        # Independent client-side handoffs run concurrently instead of one after another
+        if pending_handoffs:
+            with st.spinner(f"Running {len(pending_handoffs)} handoff(s) concurrently..."):
+                handoff_responses = asyncio.run(run_handoffs_concurrently(client, pending_handoffs))
+            
+            function_results = []
+            for (tool_call_id, handoff_agent_id, _), handoff_response in zip(pending_handoffs, handoff_responses):
+                agent_name = id_to_name.get(handoff_agent_id, 'Unknown Agent')
+                if isinstance(handoff_response, Exception):
+                    handoff_text = f"Error: {str(handoff_response)}"
+                    response_parts.append(f"\n\n**{agent_name}:** Handoff failed: {str(handoff_response)}")
+                else:
+                    handoff_text = response_text(handoff_response)
+                    if handoff_text:
+                        response_parts.append(f"\n\n**{agent_name}:**\n{handoff_text}")
+                function_results.append(FunctionResultEntry(tool_call_id=tool_call_id, result=handoff_text))
+            
+            # Hand the results back so the primary agent can finish its answer and the conversation can go on
+            try:
+                with st.spinner("Sending the handoff results to the primary agent..."):
+                    followup = client.beta.conversations.append(
+                        conversation_id=turn["conversation_id"],
+                        inputs=function_results,
+                        handoff_execution=handoff_mode
+                    )
+                followup_text = response_text(followup)
+                if followup_text:
+                    response_parts.append(f"\n\n{followup_text}")
+                conversation_ready = not any(getattr(output, 'type', None) == "function.call" for output in followup.outputs)
+            except MistralError as e:
+                response_parts.append(f"\n\nCould not send the handoff results to the primary agent: {str(e)}")
+        
+        # Only a conversation that is not waiting on function results can be continued
+        if turn["conversation_id"] and conversation_ready:
+            st.session_state.orch_conversation = {
+                "id": turn["conversation_id"],
+                "agent_id": finance_agent.id
+            }
+        
+        # The streamed reply is re-rendered from history below
+        msg_box.empty()
+        
+        # Add agent response to history once the stream has closed
+        append_orchestration_message({
+            "role": "assistant",
+            "content": "".join(response_parts),
+            "handoffs": handoffs,
+            "tool_executions": tool_executions
+        })
     
     except Exception as e:
-        st.error(f"Failed to create orchestration agents: {str(e)}")
-        return None, None, None
+        st.error(f"Error: {str(e)}")
+        # Add error message to history
+        append_orchestration_message({
+            "role": "assistant",
+            "content": f"Error: {str(e)}",
+            "handoffs": [],
+            "tool_executions": []
+        })
+
+def run_all_examples(primary_model):
+    """Run every example prompt concurrently and record the turns in their original order"""
+    with st.spinner("Preparing orchestration agents..."):
+        client, finance_agent, agent_ids, id_to_name = get_or_create_orchestration_agents(
+            st.session_state.api_key,
+            primary_model=primary_model
+        )
+    
+    if not client or not finance_agent or not agent_ids:
+        return
+    
+    # Precomputed examples are served from the cache; only the rest hit the API
+    cached_responses = {prompt: get_cached_example_response(prompt) for prompt in EXAMPLES}
+    prompts_to_run = [prompt for prompt in EXAMPLES if not cached_responses[prompt]]
+    
+    results = {}
+    if prompts_to_run:
+        with st.spinner(f"Running {len(prompts_to_run)} example prompts concurrently... This may take a moment."):
+            responses = asyncio.run(run_prompts_concurrently(client, finance_agent.id, prompts_to_run))
+        results = dict(zip(prompts_to_run, responses))
+    
+    # These turns are separate conversations, so a stored follow-up conversation no longer matches the history
+    st.session_state.pop('orch_conversation', None)
+    
+    for prompt in EXAMPLES:
+        append_orchestration_message({
+            "role": "user",
+            "content": prompt
+        })
+        
+        result = results.get(prompt)
+        if result is None:
+            append_orchestration_message({
+                "role": "assistant",
+                "content": cached_responses[prompt],
+                "handoffs": [],
+                "tool_executions": []
+            })
+        elif isinstance(result, Exception):
+            append_orchestration_message({
+                "role": "assistant",
+                "content": f"Error: {str(result)}",
+                "handoffs": [],
+                "tool_executions": []
+            })
+        else:
+            append_orchestration_message(collect_response_turn(result, id_to_name))
 
 def display_agent_orchestration_page():
     st.title("🔄 Agent Orchestration")
@@ -110,15 +758,6 @@ def display_agent_orchestration_page():
         st.warning("Please enter your Mistral API Key in the sidebar to use this feature.")
         return
     
-    # Example prompts
-    examples = [
-        "What are the current interest rates and how would they affect my investments over the next 5 years?",
-        "Compare the performance of tech stocks versus energy stocks over the past year and create a graph.",
-        "What is compound interest and how much would $10,000 grow to in 10 years at the current average savings rate?",
-        "What are the best retirement investment strategies given the current economic outlook?",
-        "Analyze the current inflation rate and show how it impacts different asset classes."
-    ]
-    
     # Select example or custom prompt
     prompt_type = st.radio(
         "Choose a prompt type:",
@@ -128,7 +767,7 @@ def display_agent_orchestration_page():
     )
     
     if prompt_type == "Example Prompts":
-        user_prompt = st.selectbox("Select an example prompt:", examples)
+        user_prompt = st.selectbox("Select an example prompt:", EXAMPLES)
     else:
         user_prompt = st.text_area(
             "Enter your custom prompt:",
@@ -147,163 +786,60 @@ def display_agent_orchestration_page():
     
     handoff_mode = "server" if handoff_execution == "Server-side (automatic)" else "client"
     
+    # Latency budget for the primary agent, which mostly routes and summarizes
+    latency_budget = st.radio(
+        "Latency budget:",
+        list(MODELS_BY_BUDGET),
+        index=0,
+        horizontal=True,
+        help="Fast uses Mistral Small for the primary agent, Balanced uses Mistral Medium and Best uses Mistral Large."
+    )
+    
+    force_orchestration = st.checkbox(
+        "Always use orchestration",
+        value=False,
+        help="By default, simple questions are answered directly by a single model without involving the specialized agents."
+    )
+    
+    # Follow-up prompts continue the stored server-side conversation until a new one is requested
+    if st.session_state.get('orch_conversation') and st.button("New conversation", key="orchestration_new_conversation"):
+        st.session_state.pop('orch_conversation', None)
+        st.info("Your next request will start a new conversation.")
+    
     # Submit button
     if st.button("Start Orchestration", key="orchestration_submit", type="primary"):
         if not user_prompt:
             st.warning("Please enter a prompt.")
             return
         
-        with st.spinner("Creating orchestration agents..."):
-            client, finance_agent, agent_ids = create_orchestration_agents(st.session_state.api_key)
-            
-            if not client or not finance_agent or not agent_ids:
-                return
-            
-            # Add the user message to the history
-            if 'orchestration_history' not in st.session_state:
-                st.session_state.orchestration_history = []
-            
-            # Add user message to history
-            st.session_state.orchestration_history.append({
+        # Example prompts with a precomputed response skip the API entirely
+        # The server-side conversation never sees cached answers, so they are only served outside one
+        serve_cached = prompt_type == "Example Prompts" and not st.session_state.get('orch_conversation')
+        cached_response = get_cached_example_response(user_prompt) if serve_cached else None
+        
+        if cached_response:
+            append_orchestration_message({
                 "role": "user",
                 "content": user_prompt
             })
-            
-            try:
-                # Start a conversation with the primary agent
-                with st.spinner("Processing your request with multiple agents... This may take a moment."):
-                    response = client.beta.conversations.start(
-                        agent_id=finance_agent.id,
-                        inputs=user_prompt,
-                        handoff_execution=handoff_mode
-                    )
-                
-                # Extract and process the agent's response
-                primary_response = ""
-                handoffs = []
-                tool_executions = []
-                
-                for output in response.outputs:
-                    if hasattr(output, 'type') and output.type == "message.output":
-                        # Handle string content
-                        if isinstance(output.content, str):
-                            primary_response += output.content
-                        # Handle list content
-                        elif isinstance(output.content, list):
-                            for content_item in output.content:
-                                # For dictionary items with get method
-                                if hasattr(content_item, 'get'):
-                                    if content_item.get("type") == "text":
-                                        primary_response += content_item.get("text", "")
-                                # For objects without get method
-                                elif hasattr(content_item, 'type'):
-                                    # Handle text content
-                                    if content_item.type == "text" and hasattr(content_item, 'text'):
-                                        primary_response += content_item.text
-                    
-                    # Track handoffs
-                    elif hasattr(output, 'type') and output.type == "handoff.execution":
-                        handoff_agent_id = ""
-                        handoff_inputs = ""
-                        
-                        if hasattr(output, 'agent_id'):
-                            handoff_agent_id = output.agent_id
-                        
-                        if hasattr(output, 'inputs'):
-                            handoff_inputs = output.inputs
-                            
-                        handoff_agent_name = next((name for name, id in agent_ids.items() if id == handoff_agent_id), "Unknown Agent")
-                        
-                        handoffs.append({
-                            "agent_name": handoff_agent_name,
-                            "agent_id": handoff_agent_id,
-                            "inputs": handoff_inputs
-                        })
-                    
-                    # Track tool executions
-                    elif hasattr(output, 'type') and output.type == "tool.execution":
-                        tool_name = ""
-                        tool_info = {}
-                        
-                        if hasattr(output, 'name'):
-                            tool_name = output.name
-                            
-                        if hasattr(output, 'info'):
-                            # Process tool info safely
-                            if hasattr(output.info, '__dict__'):
-                                # Convert object to dict
-                                try:
-                                    tool_info = output.info.__dict__
-                                except:
-                                    # If that fails, use empty dict
-                                    tool_info = {}
-                            else:
-                                # Use the info directly
-                                tool_info = output.info
-                                
-                        tool_executions.append({
-                            "tool_name": tool_name,
-                            "info": tool_info
-                        })
-                
-                # Add agent response to history
-                st.session_state.orchestration_history.append({
-                    "role": "assistant",
-                    "content": primary_response,
-                    "handoffs": handoffs,
-                    "tool_executions": tool_executions
-                })
-            
-            except Exception as e:
-                st.error(f"Error: {str(e)}")
-                # Add error message to history
-                st.session_state.orchestration_history.append({
-                    "role": "assistant",
-                    "content": f"Error: {str(e)}",
-                    "handoffs": [],
-                    "tool_executions": []
-                })
+            append_orchestration_message({
+                "role": "assistant",
+                "content": cached_response,
+                "handoffs": [],
+                "tool_executions": []
+            })
+        else:
+            run_orchestration(user_prompt, handoff_mode, MODELS_BY_BUDGET[latency_budget], force_orchestration)
+    
+    # Demo helper: fire every example prompt at once instead of one click at a time
+    if prompt_type == "Example Prompts" and st.button(
+        "Run all examples",
+        key="orchestration_run_all",
+        help="Runs every example prompt as its own conversation, in parallel, with server-side handoffs."
+    ):
+        run_all_examples(MODELS_BY_BUDGET[latency_budget])
     
     # Display chat history
     st.markdown("### Conversation & Orchestration Flow")
     
-    # Create a chat container with scrolling
-    chat_container = st.container()
-    
-    with chat_container:
-        for message in st.session_state.orchestration_history:
-            is_user = message["role"] == "user"
-            
-            # Display the message
-            display_chat_message(message["content"], is_user)
-            
-            # Display orchestration details for assistant messages
-            if not is_user:
-                # Show handoffs
-                if "handoffs" in message and message["handoffs"]:
-                    with st.expander("Agent Handoffs", expanded=True):
-                        for i, handoff in enumerate(message["handoffs"]):
-                            st.markdown(f"**Handoff {i+1}:** Primary Agent → {handoff['agent_name']}")
-                            st.markdown(f"**Input:** {handoff['inputs']}")
-                            st.markdown("---")
-                
-                # Show tool executions
-                if "tool_executions" in message and message["tool_executions"]:
-                    with st.expander("Tool Executions", expanded=True):
-                        for i, tool in enumerate(message["tool_executions"]):
-                            st.markdown(f"**Tool {i+1}:** {tool['tool_name']}")
-                            
-                            # Show code interpreter executions
-                            if tool["tool_name"] == "code_interpreter" and "code" in tool.get("info", {}):
-                                st.markdown("**Code:**")
-                                st.code(tool["info"]["code"], language="python")
-                                
-                                st.markdown("**Output:**")
-                                st.code(tool["info"].get("code_output", "No output"))
-                            
-                            st.markdown("---")
-    
-    # Clear history button
-    if st.session_state.orchestration_history and st.button("Clear History", key="clear_orchestration_history"):
-        st.session_state.orchestration_history = []
-        st.rerun()
+    render_chat()
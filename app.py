@@ -1,22 +1,6 @@
 import streamlit as st
 import os
-import json
-import base64
-from datetime import datetime
-import pandas as pd
-import matplotlib.pyplot as plt
-import io
-from PIL import Image
-import plotly.express as px
-import plotly.graph_objects as go
-from utils import (
-    copy_to_clipboard, 
-    download_button, 
-    download_image_button,
-    display_chat_message,
-    styled_expander,
-    init_session_state
-)
+from utils import styled_expander, init_session_state
 
 # Import feature modules
 from code_interpreter import display_code_interpreter_page
@@ -25,6 +9,15 @@ from web_search import display_web_search_page
 from agent_orchestration import display_agent_orchestration_page
 from function_calls import display_function_calls_page
 
+# Stylesheet path, resolved relative to this file so the app can be started from any directory
+CSS_PATH = os.path.join(os.path.dirname(os.path.abspath(__file__)), "static", "styles.css")
+
+@st.cache_resource
+def load_css():
+    """Read the app stylesheet from disk once per process"""
+    with open(CSS_PATH, encoding="utf-8") as f:
+        return f.read()
+
 # Set page configuration
 st.set_page_config(
     page_title="Mistral AI Agents Explorer",
@@ -37,113 +30,7 @@ st.set_page_config(
 init_session_state()
 
 # Custom CSS for better styling
-st.markdown("""
-<style>
-    .main {
-        padding: 2rem;
-        max-width: 1200px;
-        margin: 0 auto;
-    }
-    
-    .stTabs [data-baseweb="tab-list"] {
-        gap: 8px;
-    }
-    
-    .stTabs [data-baseweb="tab"] {
-        height: 50px;
-        white-space: pre-wrap;
-        background-color: #f0f2f6;
-        border-radius: 6px 6px 0px 0px;
-        gap: 1px;
-        padding-top: 10px;
-        padding-bottom: 10px;
-    }
-    
-    .stTabs [aria-selected="true"] {
-        background-color: #e1f5fe;
-        border-radius: 6px 6px 0px 0px;
-    }
-    
-    .chat-container {
-        display: flex;
-        flex-direction: column;
-        height: 60vh;
-        overflow-y: auto;
-        padding: 10px;
-        border: 1px solid #e0e0e0;
-        border-radius: 8px;
-        background-color: white;
-    }
-    
-    .title-container {
-        border-radius: 10px;
-        padding: 20px;
-        background: linear-gradient(90deg, #1E3B70 0%, #29539B 100%);
-        color: white;
-        text-align: center;
-        margin-bottom: 20px;
-    }
-    
-    .card {
-        border-radius: 10px;
-        padding: 20px;
-        background-color: white;
-        box-shadow: 0 4px 6px rgba(0, 0, 0, 0.1);
-        margin-bottom: 20px;
-        transition: transform 0.3s ease;
-    }
-    
-    .card:hover {
-        transform: translateY(-5px);
-    }
-    
-    .agent-icon {
-        font-size: 2rem;
-        margin-bottom: 10px;
-    }
-    
-    .stButton button {
-        width: 100%;
-        border-radius: 8px;
-        font-weight: bold;
-        color: white;
-        background-color: #1E3B70;
-        border: none;
-        padding: 10px 15px;
-        transition: all 0.3s ease;
-    }
-    
-    .stButton button:hover {
-        background-color: #29539B;
-        transform: scale(1.02);
-    }
-    
-    .api-key-input input {
-        border-radius: 8px;
-        border: 1px solid #e0e0e0;
-        padding: 10px;
-    }
-    
-    /* Custom styling for the sidebar */
-    .sidebar .sidebar-content {
-        background-color: #f9f9f9;
-        padding: 20px;
-    }
-    
-    /* Styling for code blocks */
-    pre {
-        background-color: #f7f7f7;
-        border-radius: 5px;
-        padding: 10px;
-        overflow-x: auto;
-    }
-    
-    code {
-        font-family: monospace;
-        white-space: pre-wrap;
-    }
-</style>
-""", unsafe_allow_html=True)
+st.markdown(f"<style>{load_css()}</style>", unsafe_allow_html=True)
 
 # Sidebar for API key configuration and navigation
 with st.sidebar:
@@ -1,177 +1,200 @@
 import streamlit as st
-import json
-from mistralai import Mistral
-import pandas as pd
-import matplotlib.pyplot as plt
-import io
-from PIL import Image
-import base64
-from utils import copy_to_clipboard, download_button, display_chat_message
+import re
+import hashlib
+import time
+from collections import OrderedDict
+from uuid import uuid4
+from utils import copy_to_clipboard, display_chat_message, get_cached_agent, get_mistral_client, handle_message_delta, stream_events, CHAT_HISTORY_LIMIT, CHAT_HISTORY_INLINE
 
-def create_code_agent(api_key):
-    """Create a code interpreter agent using Mistral API"""
-    try:
-        client = Mistral(api_key=api_key)
-        
-        code_agent = client.beta.agents.create(
-            model="mistral-medium-latest",
-            name="Code Interpreter Agent",
-            description="Agent used to execute code using the interpreter tool.",
-            instructions="Use the code interpreter tool when you have to run code. "
-                        "You're excellent at data analysis, visualization, and solving computational problems.",
-            tools=[{"type": "code_interpreter"}],
-            completion_args={
-                "temperature": 0.3,
-                "top_p": 0.95
-            }
-        )
-        
-        return client, code_agent
-    except Exception as e:
-        st.error(f"Failed to create code agent: {str(e)}")
-        return None, None
+# Page intro and example prompts
+_INTRO_MD = """
+The Code Interpreter agent allows you to execute Python code in a secure sandbox environment. 
+This is invaluable for tasks requiring computation, data manipulation, or visualization.
 
-def display_code_interpreter_page():
-    st.title("💻 Code Interpreter Agent")
-    
-    st.markdown("""
-    The Code Interpreter agent allows you to execute Python code in a secure sandbox environment. 
-    This is invaluable for tasks requiring computation, data manipulation, or visualization.
+### Capabilities:
+- Mathematical calculation and analysis
+- Data visualization and plotting
+- Scientific computing and simulation
+- Code validation and execution
+
+Try it out with examples like generating Fibonacci sequences, plotting data, or solving mathematical problems.
+"""
+
+_EXAMPLES = (
+    "Generate the first 20 numbers of the Fibonacci sequence and plot them.",
+    "Create a scatter plot with random data and add a trend line.",
+    "Calculate the first 50 prime numbers and visualize their distribution.",
+    "Create a DataFrame with sample sales data and calculate monthly averages.",
+    "Simulate a random walk and visualize it as an animated plot."
+)
+
+# Detects plotting code whose figures can't be shown from the sandbox
+_PLOT_RE = re.compile(r"savefig|plt\.show\(\)").search
+
+# How long a finished answer is reused when the same prompt is submitted again, and how many are kept
+RESPONSE_CACHE_TTL_SECONDS = 3600
+RESPONSE_CACHE_LIMIT = 20
+
+def _response_cache_key(api_key, agent_id, prompt):
+    """Key cached answers by a hash of the API key rather than the key itself"""
+    return (hashlib.blake2b(api_key.encode(), digest_size=16).hexdigest(), agent_id, prompt)
+
+def _cache_response(cache, cache_key, final_text, code_blocks):
+    """Store an answer, dropping expired answers and the oldest beyond the limit"""
+    now = time.monotonic()
     
-    ### Capabilities:
-    - Mathematical calculation and analysis
-    - Data visualization and plotting
-    - Scientific computing and simulation
-    - Code validation and execution
+    # Re-inserting moves the key to the end, so the cache stays ordered oldest first
+    cache.pop(cache_key, None)
+    cache[cache_key] = (now, final_text, code_blocks)
     
-    Try it out with examples like generating Fibonacci sequences, plotting data, or solving mathematical problems.
-    """)
+    while cache and (len(cache) > RESPONSE_CACHE_LIMIT or now - next(iter(cache.values()))[0] >= RESPONSE_CACHE_TTL_SECONDS):
+        cache.popitem(last=False)
+
+def create_code_agent(api_key):
+    """Create a code interpreter agent using Mistral API"""
+    client = get_mistral_client(api_key)
     
-    # API key check
-    if not st.session_state.api_key:
-        st.warning("Please enter your Mistral API Key in the sidebar to use this feature.")
-        return
+    code_agent = client.beta.agents.create(
+        model="mistral-medium-latest",
+        name="Code Interpreter Agent",
+        description="Agent used to execute code using the interpreter tool.",
+        instructions="Use the code interpreter tool when you have to run code. "
+                    "You're excellent at data analysis, visualization, and solving computational problems.",
+        tools=[{"type": "code_interpreter"}],
+        completion_args={
+            "temperature": 0.3,
+            "top_p": 0.95
+        }
+    )
     
-    # Example prompts
-    examples = [
-        "Generate the first 20 numbers of the Fibonacci sequence and plot them.",
-        "Create a scatter plot with random data and add a trend line.",
-        "Calculate the first 50 prime numbers and visualize their distribution.",
-        "Create a DataFrame with sample sales data and calculate monthly averages.",
-        "Simulate a random walk and visualize it as an animated plot."
-    ]
+    return client, code_agent
+
+def get_or_create_code_agent(api_key):
+    """Return the code interpreter agent for this API key, creating it on first use"""
+    return get_cached_agent(create_code_agent, api_key, "code agent")
+
+def _extract_tool_exec(output):
+    """Return the code and output of a code interpreter execution, or None for other tools"""
+    if getattr(output, 'name', None) != "code_interpreter":
+        return None
     
-    # Select example or custom prompt
-    prompt_type = st.radio(
-        "Choose a prompt type:",
-        ["Example Prompts", "Custom Prompt"],
-        index=0,
-        horizontal=True
-    )
+    # Get code and output safely
+    info = getattr(output, 'info', None) or {}
+    if isinstance(info, dict):
+        return {"code": info.get("code", ""), "output": info.get("code_output", "")}
+    return {"code": getattr(info, 'code', ""), "output": getattr(info, 'code_output', "")}
+
+def _handle_tool_execution(data, turn):
+    """Collect a finished code execution"""
+    code_block = _extract_tool_exec(data)
+    if code_block is not None:
+        turn["code_blocks"].append(code_block)
+
+_HANDLERS = {
+    "message.output.delta": handle_message_delta,
+    "tool.execution.done": _handle_tool_execution
+}
+
+def _fenced(text, language=""):
+    """Wrap text in a markdown code fence longer than any backtick run inside it"""
+    fence = "`" * max(3, max((len(run) for run in re.findall(r"`+", text)), default=0) + 1)
+    return f"{fence}{language}\n{text}\n{fence}"
+
+def render_code_message(message):
+    """Render one chat message with its details"""
+    is_user = message["role"] == "user"
     
-    if prompt_type == "Example Prompts":
-        user_prompt = st.selectbox("Select an example prompt:", examples)
-    else:
-        user_prompt = st.text_area(
-            "Enter your custom prompt:",
-            placeholder="Example: Analyze a sample dataset with 100 random points and create a histogram of the distribution.",
-            height=100
-        )
+    # Display the message
+    display_chat_message(message["content"], is_user, key=message["key"])
     
+    # Display code blocks for assistant messages
+    if not is_user and "code_blocks" in message and message["code_blocks"]:
+        for i, code_block in enumerate(message["code_blocks"]):
+            with st.expander(f"Code Execution {i+1}", expanded=True):
+                # Code and output go out as one markdown element
+                st.markdown(f"**Code:**\n{_fenced(code_block['code'], 'python')}\n**Output:**\n{_fenced(code_block['output'])}")
+                
+                # Add copy code button
+                copy_to_clipboard(code_block["code"], "Copy Code", key=f"{message['key']}_{i}")
+                
+                # Try to detect if the output contains an image (matplotlib plot)
+                if _PLOT_RE(code_block["code"]):
+                    st.info("Note: Visualizations executed in the Mistral sandbox are not directly visible here. The output shows text representation only.")
+
+@st.fragment
+def _chat_fragment(user_prompt):
+    """Handle Submit and render the chat history; widgets in here only rerun this fragment"""
     # Submit button
     if st.button("Submit", key="code_submit", type="primary"):
         if not user_prompt:
             st.warning("Please enter a prompt.")
             return
         
-        with st.spinner("Creating code interpreter agent..."):
-            client, code_agent = create_code_agent(st.session_state.api_key)
-            
-            if not client or not code_agent:
-                return
-            
-            # Add the user message to the history
-            if 'code_interpreter_history' not in st.session_state:
-                st.session_state.code_interpreter_history = []
-            
-            # Add user message to history
-            st.session_state.code_interpreter_history.append({
-                "role": "user",
-                "content": user_prompt
-            })
+        with st.spinner("Preparing code interpreter agent..."):
+            client, code_agent = get_or_create_code_agent(st.session_state.api_key)
+        
+        if not client or not code_agent:
+            return
+        
+        # Add the user message to the history
+        if 'code_interpreter_history' not in st.session_state:
+            st.session_state.code_interpreter_history = []
+        if 'code_response_cache' not in st.session_state:
+            st.session_state.code_response_cache = OrderedDict()
+        
+        # Add user message to history
+        st.session_state.code_interpreter_history.append({
+            "key": uuid4().hex[:10],
+            "role": "user",
+            "content": user_prompt
+        })
+        
+        try:
+            # Reuse the answer if the same prompt was already run recently
+            cache_key = _response_cache_key(st.session_state.api_key, code_agent.id, user_prompt)
+            cached = st.session_state.code_response_cache.get(cache_key)
             
-            try:
-                # Start a conversation with the agent
+            if cached and time.monotonic() - cached[0] < RESPONSE_CACHE_TTL_SECONDS:
+                final_text, code_blocks = cached[1], cached[2]
+            else:
+                # Stream the conversation with the agent so text shows up as it is generated
+                turn = {"text_parts": [], "code_blocks": []}
+                placeholder = st.empty()
+                
                 with st.spinner("Generating response..."):
-                    response = client.beta.conversations.start(
+                    stream = client.beta.conversations.start_stream(
                         agent_id=code_agent.id,
                         inputs=user_prompt
                     )
+                    with placeholder.container():
+                        st.write_stream(stream_events(stream, turn, _HANDLERS))
                 
-                # Extract and process the agent's response
-                code_blocks = []
-                outputs = []
-                final_text = ""
-                
-                # Process the response more carefully
-                for output in response.outputs:
-                    # Handle message outputs
-                    if hasattr(output, 'type') and output.type == "message.output":
-                        # Handle string content
-                        if isinstance(output.content, str):
-                            final_text += output.content
-                        # Handle list content
-                        elif isinstance(output.content, list):
-                            for content_item in output.content:
-                                # For dictionary items with get method
-                                if hasattr(content_item, 'get'):
-                                    if content_item.get("type") == "text":
-                                        final_text += content_item.get("text", "")
-                                # For objects without get method (like ToolFileChunk)
-                                elif hasattr(content_item, 'type') and content_item.type == "text":
-                                    if hasattr(content_item, 'text'):
-                                        final_text += content_item.text
-                    
-                    # Handle tool executions
-                    elif hasattr(output, 'type') and output.type == "tool.execution":
-                        if hasattr(output, 'name') and output.name == "code_interpreter":
-                            # Handle tool info safely
-                            if hasattr(output, 'info'):
-                                info = output.info
-                                code = ""
-                                code_output = ""
-                                
-                                # Get code and output safely
-                                if hasattr(info, 'code'):
-                                    code = info.code
-                                elif hasattr(info, 'get') and info.get("code"):
-                                    code = info.get("code")
-                                    
-                                if hasattr(info, 'code_output'):
-                                    code_output = info.code_output
-                                elif hasattr(info, 'get') and info.get("code_output"):
-                                    code_output = info.get("code_output")
-                                    
-                                code_blocks.append({
-                                    "code": code,
-                                    "output": code_output
-                                })
-                
-                # Add agent response to history
-                st.session_state.code_interpreter_history.append({
-                    "role": "assistant",
-                    "content": final_text,
-                    "code_blocks": code_blocks
-                })
+                # The streamed reply is re-rendered from history below
+                placeholder.empty()
+                final_text = "".join(turn["text_parts"])
+                code_blocks = turn["code_blocks"]
+                _cache_response(st.session_state.code_response_cache, cache_key, final_text, code_blocks)
             
-            except Exception as e:
-                st.error(f"Error: {str(e)}")
-                # Add error message to history
-                st.session_state.code_interpreter_history.append({
-                    "role": "assistant",
-                    "content": f"Error: {str(e)}",
-                    "code_blocks": []
-                })
+            # Add agent response to history
+            st.session_state.code_interpreter_history.append({
+                "key": uuid4().hex[:10],
+                "role": "assistant",
+                "content": final_text,
+                "code_blocks": code_blocks
+            })
+        
+        except Exception as e:
+            st.error(f"Error: {str(e)}")
+            # Add error message to history
+            st.session_state.code_interpreter_history.append({
+                "key": uuid4().hex[:10],
+                "role": "assistant",
+                "content": f"Error: {str(e)}",
+                "code_blocks": []
+            })
+        
+        # Keep only the most recent messages
+        st.session_state.code_interpreter_history = st.session_state.code_interpreter_history[-CHAT_HISTORY_LIMIT:]
     
     # Display chat history
     st.markdown("### Conversation History")
@@ -180,30 +203,50 @@ def display_code_interpreter_page():
     chat_container = st.container()
     
     with chat_container:
-        for message in st.session_state.code_interpreter_history:
-            is_user = message["role"] == "user"
-            
-            # Display the message
-            display_chat_message(message["content"], is_user)
-            
-            # Display code blocks for assistant messages
-            if not is_user and "code_blocks" in message and message["code_blocks"]:
-                for i, code_block in enumerate(message["code_blocks"]):
-                    with st.expander(f"Code Execution {i+1}", expanded=True):
-                        st.markdown("**Code:**")
-                        st.code(code_block["code"], language="python")
-                        
-                        # Add copy code button
-                        copy_to_clipboard(code_block["code"], "Copy Code")
-                        
-                        st.markdown("**Output:**")
-                        st.code(code_block["output"])
-                        
-                        # Try to detect if the output contains an image (matplotlib plot)
-                        if "savefig" in code_block["code"] or "plt.show()" in code_block["code"]:
-                            st.info("Note: Visualizations executed in the Mistral sandbox are not directly visible here. The output shows text representation only.")
+        history = st.session_state.code_interpreter_history
+        
+        # Older messages are only rendered on request so reruns stay cheap in long sessions
+        earlier = history[:-CHAT_HISTORY_INLINE]
+        if earlier and st.toggle(f"Show {len(earlier)} earlier messages", key="show_earlier_code"):
+            for message in earlier:
+                render_code_message(message)
+        
+        for message in history[-CHAT_HISTORY_INLINE:]:
+            render_code_message(message)
     
     # Clear history button
     if st.session_state.code_interpreter_history and st.button("Clear History", key="clear_code_history"):
         st.session_state.code_interpreter_history = []
+        st.session_state.code_response_cache = OrderedDict()
         st.rerun()
+
+def display_code_interpreter_page():
+    st.title("💻 Code Interpreter Agent")
+    
+    # Rendered on full reruns only; Submit and history reruns stay inside _chat_fragment
+    st.markdown(_INTRO_MD)
+    
+    # API key check
+    if not st.session_state.api_key:
+        st.warning("Please enter your Mistral API Key in the sidebar to use this feature.")
+        return
+    
+    # Select example or custom prompt
+    prompt_type = st.radio(
+        "Choose a prompt type:",
+        ["Example Prompts", "Custom Prompt"],
+        index=0,
+        horizontal=True
+    )
+    
+    if prompt_type == "Example Prompts":
+        user_prompt = st.selectbox("Select an example prompt:", _EXAMPLES)
+    else:
+        user_prompt = st.text_area(
+            "Enter your custom prompt:",
+            placeholder="Example: Analyze a sample dataset with 100 random points and create a histogram of the distribution.",
+            height=100
+        )
+    
+    # Submit and chat history rerun on their own when the buttons are clicked
+    _chat_fragment(user_prompt)
@@ -1,109 +1,144 @@
 import streamlit as st
 import json
+import inspect
+import time
+from functools import lru_cache
 from datetime import datetime
-import pandas as pd
-from mistralai import Mistral
-from utils import copy_to_clipboard, download_button, display_chat_message
+from mistralai import FunctionResultEntry
+from uuid import uuid4
+from utils import display_chat_message, extract_text, get_cached_agent, get_mistral_client, handle_message_delta, stream_events, CHAT_HISTORY_LIMIT, CHAT_HISTORY_INLINE
+
+# Mock interest rate data, keyed by lowercase region
+_RATES = {
+    "us": {"rate": 5.5, "name": "Federal Reserve", "last_updated": "2023-12-13"},
+    "ecb": {"rate": 4.0, "name": "European Central Bank", "last_updated": "2023-12-14"},
+    "uk": {"rate": 5.25, "name": "Bank of England", "last_updated": "2023-12-15"},
+    "japan": {"rate": -0.1, "name": "Bank of Japan", "last_updated": "2023-12-10"},
+    "australia": {"rate": 4.35, "name": "Reserve Bank of Australia", "last_updated": "2023-12-05"},
+    "canada": {"rate": 5.0, "name": "Bank of Canada", "last_updated": "2023-12-06"},
+}
+_REGIONS = tuple(_RATES)
+
+# Reusable JSON codec; compact separators keep the payload sent back to the API small
+_ENCODE = json.JSONEncoder(separators=(',', ':'), ensure_ascii=False).encode
+_DECODE = json.JSONDecoder().decode
+_PRETTY = json.JSONEncoder(indent=2, ensure_ascii=False).encode
+
+# Page intro and example prompts
+_INTRO_MD = """
+Function Calls allow agents to interact with external APIs, databases, or proprietary systems by defining 
+JSON schemas for custom functions. This gives agents the ability to perform specific actions or retrieve 
+specialized information beyond their built-in capabilities.
+
+### How it works:
+1. Define custom functions with parameters, descriptions, and JSON schemas
+2. The agent decides when to call these functions based on user queries
+3. The application executes the function calls and returns results to the agent
+4. The agent incorporates the results into its response
+
+This demonstration includes functions for retrieving financial data and performing calculations.
+"""
+
+_EXAMPLES = (
+    "What is the current interest rate in the US?",
+    "Calculate the monthly payment for a $300,000 loan at 5.2% interest over 30 years.",
+    "Compare the interest rates between the ECB and the Bank of England.",
+    "What would be my monthly payment for a $50,000 car loan at 4.5% for 5 years?",
+    "Get me the interest rate from the Bank of Japan and explain what negative rates mean."
+)
 
 def create_function_call_agent(api_key):
     """Create an agent with custom function calls using Mistral API"""
-    try:
-        client = Mistral(api_key=api_key)
-        
-        # Define a custom function for getting interest rates
-        function_agent = client.beta.agents.create(
-            model="mistral-medium-latest",
-            name="Function Call Agent",
-            description="Agent that can call custom functions to retrieve information.",
-            instructions="You can use custom functions to get interest rates and perform financial calculations.",
-            tools=[
-                {
-                    "type": "function",
-                    "function": {
-                        "name": "get_interest_rate",
-                        "description": "Get the current interest rate for a specific region or central bank.",
-                        "parameters": {
-                            "type": "object",
-                            "properties": {
-                                "region": {
-                                    "type": "string",
-                                    "description": "The region or central bank to get the interest rate for (e.g., US, ECB, UK, Japan)"
-                                },
-                                "date": {
-                                    "type": "string",
-                                    "description": "The date for which to fetch the rate, in YYYY-MM-DD format"
-                                }
+    client = get_mistral_client(api_key)
+    
+    # Define a custom function for getting interest rates
+    function_agent = client.beta.agents.create(
+        model="mistral-medium-latest",
+        name="Function Call Agent",
+        description="Agent that can call custom functions to retrieve information.",
+        instructions="You can use custom functions to get interest rates and perform financial calculations.",
+        tools=[
+            {
+                "type": "function",
+                "function": {
+                    "name": "get_interest_rate",
+                    "description": "Get the current interest rate for a specific region or central bank.",
+                    "parameters": {
+                        "type": "object",
+                        "properties": {
+                            "region": {
+                                "type": "string",
+                                "description": "The region or central bank to get the interest rate for (e.g., US, ECB, UK, Japan)"
                             },
-                            "required": ["region"]
-                        }
+                            "date": {
+                                "type": "string",
+                                "description": "The date for which to fetch the rate, in YYYY-MM-DD format"
+                            }
+                        },
+                        "required": ["region"]
                     }
-                },
-                {
-                    "type": "function",
-                    "function": {
-                        "name": "calculate_loan_payment",
-                        "description": "Calculate monthly payment for a loan with given parameters.",
-                        "parameters": {
-                            "type": "object",
-                            "properties": {
-                                "principal": {
-                                    "type": "number",
-                                    "description": "The loan amount (principal)"
-                                },
-                                "annual_interest_rate": {
-                                    "type": "number",
-                                    "description": "Annual interest rate as a percentage (e.g., 5.2 for 5.2%)"
-                                },
-                                "term_years": {
-                                    "type": "number",
-                                    "description": "Loan term in years"
-                                }
+                }
+            },
+            {
+                "type": "function",
+                "function": {
+                    "name": "calculate_loan_payment",
+                    "description": "Calculate monthly payment for a loan with given parameters.",
+                    "parameters": {
+                        "type": "object",
+                        "properties": {
+                            "principal": {
+                                "type": "number",
+                                "description": "The loan amount (principal)"
+                            },
+                            "annual_interest_rate": {
+                                "type": "number",
+                                "description": "Annual interest rate as a percentage (e.g., 5.2 for 5.2%)"
                             },
-                            "required": ["principal", "annual_interest_rate", "term_years"]
-                        }
+                            "term_years": {
+                                "type": "number",
+                                "description": "Loan term in years"
+                            }
+                        },
+                        "required": ["principal", "annual_interest_rate", "term_years"]
                     }
                 }
-            ],
-            completion_args={
-                "temperature": 0.3,
-                "top_p": 0.95
             }
-        )
-        
-        return client, function_agent
-    except Exception as e:
-        st.error(f"Failed to create function call agent: {str(e)}")
-        return None, None
+        ],
+        completion_args={
+            "temperature": 0.3,
+            "top_p": 0.95
+        }
+    )
+    
+    return client, function_agent
+
+def get_or_create_function_call_agent(api_key):
+    """Return the function call agent for this API key, creating it on first use"""
+    return get_cached_agent(create_function_call_agent, api_key, "function call agent")
+
+@lru_cache(maxsize=1)
+def _today_key(minute):
+    """Format today's date, recomputed at most once per minute"""
+    return datetime.now().strftime("%Y-%m-%d")
 
 def get_interest_rate(region, date=None):
     """Mock function to get interest rates for different regions"""
     # In a real application, this would call an external API
-    if not date:
-        date = datetime.now().strftime("%Y-%m-%d")
-    
-    rates = {
-        "us": {"rate": 5.5, "name": "Federal Reserve", "last_updated": "2023-12-13"},
-        "ecb": {"rate": 4.0, "name": "European Central Bank", "last_updated": "2023-12-14"},
-        "uk": {"rate": 5.25, "name": "Bank of England", "last_updated": "2023-12-15"},
-        "japan": {"rate": -0.1, "name": "Bank of Japan", "last_updated": "2023-12-10"},
-        "australia": {"rate": 4.35, "name": "Reserve Bank of Australia", "last_updated": "2023-12-05"},
-        "canada": {"rate": 5.0, "name": "Bank of Canada", "last_updated": "2023-12-06"},
-    }
-    
-    region_lower = region.lower()
-    if region_lower in rates:
-        return {
-            "region": region,
-            "date": date,
-            "interest_rate": f"{rates[region_lower]['rate']}%",
-            "central_bank": rates[region_lower]['name'],
-            "last_updated": rates[region_lower]['last_updated']
-        }
-    else:
+    entry = _RATES.get(region.lower())
+    if entry is None:
         return {
             "error": f"No interest rate data available for {region}",
-            "available_regions": list(rates.keys())
+            "available_regions": list(_REGIONS)
         }
+    
+    return {
+        "region": region,
+        "date": date or _today_key(int(time.time()) // 60),
+        "interest_rate": f"{entry['rate']}%",
+        "central_bank": entry['name'],
+        "last_updated": entry['last_updated']
+    }
 
 def calculate_loan_payment(principal, annual_interest_rate, term_years):
     """Calculate monthly payment for a loan"""
@@ -111,13 +146,16 @@ def calculate_loan_payment(principal, annual_interest_rate, term_years):
     monthly_rate = annual_interest_rate / 100 / 12
     
     # Calculate total number of payments
-    payments = term_years * 12
+    payments = round(term_years * 12)
+    if payments < 1:
+        return {"error": f"A loan term of {term_years} years is shorter than one monthly payment"}
     
     # Calculate monthly payment using the loan formula
     if monthly_rate == 0:
         monthly_payment = principal / payments
     else:
-        monthly_payment = principal * (monthly_rate * (1 + monthly_rate) ** payments) / ((1 + monthly_rate) ** payments - 1)
+        pow_term = (1 + monthly_rate) ** payments
+        monthly_payment = principal * monthly_rate * pow_term / (pow_term - 1)
     
     # Calculate total payment and interest
     total_payment = monthly_payment * payments
@@ -133,203 +171,258 @@ def calculate_loan_payment(principal, annual_interest_rate, term_years):
         "number_of_payments": payments
     }
 
-def display_function_calls_page():
-    st.title("📞 Function Calls")
-    
-    st.markdown("""
-    Function Calls allow agents to interact with external APIs, databases, or proprietary systems by defining 
-    JSON schemas for custom functions. This gives agents the ability to perform specific actions or retrieve 
-    specialized information beyond their built-in capabilities.
-    
-    ### How it works:
-    1. Define custom functions with parameters, descriptions, and JSON schemas
-    2. The agent decides when to call these functions based on user queries
-    3. The application executes the function calls and returns results to the agent
-    4. The agent incorporates the results into its response
-    
-    This demonstration includes functions for retrieving financial data and performing calculations.
-    """)
-    
-    # API key check
-    if not st.session_state.api_key:
-        st.warning("Please enter your Mistral API Key in the sidebar to use this feature.")
-        return
+def _parse_arguments(raw):
+    """Return function call arguments as a dict, parsing JSON only when the SDK has not already done so"""
+    if isinstance(raw, dict):
+        return raw
+    if isinstance(raw, bytes):
+        raw = raw.decode()
+    if isinstance(raw, str):
+        try:
+            # Try to parse arguments as JSON
+            return _DECODE(raw)
+        except ValueError:
+            # If parsing fails, use as string
+            return {"raw_args": raw}
+    return {"raw_args": str(raw)}
+
+def _handle_response_started(data, turn):
+    """Remember the conversation id so function results can be sent back to it"""
+    turn["conversation_id"] = data.conversation_id
+
+def _handle_function_call_delta(data, turn):
+    """Accumulate function call arguments, which arrive in pieces keyed by tool call id"""
+    tool_call = turn["tool_calls"].setdefault(data.tool_call_id, {"name": data.name, "arguments": ""})
+    if isinstance(data.arguments, str):
+        tool_call["arguments"] += data.arguments
+    else:
+        # Already parsed by the SDK, keep it as is
+        tool_call["arguments"] = data.arguments
+
+_HANDLERS = {
+    "conversation.response.started": _handle_response_started,
+    "message.output.delta": handle_message_delta,
+    "function.call.delta": _handle_function_call_delta
+}
+
+# Functions the agent can call, by the name declared in its tools
+_TOOLS = {
+    "get_interest_rate": get_interest_rate,
+    "calculate_loan_payment": calculate_loan_payment
+}
+
+@lru_cache(maxsize=None)
+def _signature(fn):
+    """Inspect a tool's signature once"""
+    return inspect.signature(fn)
+
+def run_tool(function_name, args):
+    """Call the named tool with the model's arguments, returning an error result if that is not possible"""
+    fn = _TOOLS.get(function_name)
+    if fn is None:
+        return {"error": f"unknown tool {function_name}"}
     
-    # Example prompts
-    examples = [
-        "What is the current interest rate in the US?",
-        "Calculate the monthly payment for a $300,000 loan at 5.2% interest over 30 years.",
-        "Compare the interest rates between the ECB and the Bank of England.",
-        "What would be my monthly payment for a $50,000 car loan at 4.5% for 5 years?",
-        "Get me the interest rate from the Bank of Japan and explain what negative rates mean."
-    ]
+    try:
+        bound = _signature(fn).bind(**args)
+    except TypeError as e:
+        return {"error": f"Invalid arguments for {function_name}: {str(e)}"}
     
-    # Select example or custom prompt
-    prompt_type = st.radio(
-        "Choose a prompt type:",
-        ["Example Prompts", "Custom Prompt"],
-        index=0,
-        horizontal=True
+    # Bad argument values fail inside the tool; the agent gets the error instead of the turn aborting
+    try:
+        return fn(*bound.args, **bound.kwargs)
+    except Exception as e:
+        return {"error": f"{function_name} failed: {str(e)}"}
+
+def continue_with_results(client, conversation_id, function_results):
+    """Send every function result back to the conversation in a single request"""
+    return client.beta.conversations.append(
+        conversation_id=conversation_id,
+        inputs=[
+            FunctionResultEntry(
+                tool_call_id=function_result["tool_call_id"],
+                result=function_result["result"] if isinstance(function_result["result"], str) else _ENCODE(function_result["result"])
+            )
+            for function_result in function_results
+        ]
     )
+
+def render_function_message(message):
+    """Render one chat message with its details"""
+    is_user = message["role"] == "user"
     
-    if prompt_type == "Example Prompts":
-        user_prompt = st.selectbox("Select an example prompt:", examples)
-    else:
-        user_prompt = st.text_area(
-            "Enter your custom prompt:",
-            placeholder="Example: What is the current interest rate in Australia?",
-            height=100
-        )
+    # Display the message
+    display_chat_message(message["content"], is_user, key=message["key"])
     
+    # Display function call details for assistant messages
+    if not is_user:
+        # Show function calls
+        if "function_calls" in message and message["function_calls"]:
+            with st.expander("Function Calls", expanded=True):
+                # All calls go out as one markdown element
+                st.markdown("".join(
+                    f"**Function Call {i+1}:** {call['function_name']}\n\n**Arguments:**\n```json\n{_PRETTY(call['arguments'])}\n```\n\n---\n\n"
+                    for i, call in enumerate(message["function_calls"])
+                ))
+        
+        # Show function results
+        if "function_results" in message and message["function_results"]:
+            with st.expander("Function Results", expanded=True):
+                for i, result in enumerate(message["function_results"]):
+                    header = f"**Function Result {i+1}:** {result['function_name']}\n\n**Result:**"
+                    
+                    # Format the result as a table if it's a suitable type
+                    if result['function_name'] == "calculate_loan_payment" and "error" not in result['result']:
+                        # Create a more user-friendly display for loan calculations
+                        loan_data = result['result']
+                        
+                        st.markdown(header)
+                        
+                        # Main metrics in columns
+                        col1, col2, col3 = st.columns(3)
+                        with col1:
+                            st.metric("Monthly Payment", f"${loan_data['monthly_payment']}")
+                        with col2:
+                            st.metric("Total Interest", f"${loan_data['total_interest']}")
+                        with col3:
+                            st.metric("Total Payment", f"${loan_data['total_payment']}")
+                        
+                        # Additional details
+                        st.markdown(
+                            f"**Loan Details:**\n"
+                            f"- Principal: ${loan_data['principal']}\n"
+                            f"- Interest Rate: {loan_data['annual_interest_rate']}\n"
+                            f"- Term: {loan_data['term_years']} years ({loan_data['number_of_payments']} payments)\n\n"
+                            f"---"
+                        )
+                        
+                    elif result['function_name'] == "get_interest_rate" and "error" not in result['result']:
+                        # Create a card-like display for interest rate
+                        rate_data = result['result']
+                        
+                        st.markdown(header)
+                        st.markdown(f"""
+                        <div style="padding: 15px; border-radius: 10px; background-color: #f0f7ff; margin-bottom: 10px;">
+                            <h3 style="margin-top: 0;">{rate_data['central_bank']}</h3>
+                            <h2 style="color: #1E88E5;">{rate_data['interest_rate']}</h2>
+                            <p>Region: {rate_data['region']}</p>
+                            <p>Last Updated: {rate_data['last_updated']}</p>
+                        </div>
+                        """, unsafe_allow_html=True)
+                        st.markdown("---")
+                    else:
+                        # Default to a JSON block in the same markdown element as the header
+                        st.markdown(f"{header}\n```json\n{_PRETTY(result['result'])}\n```\n\n---")
+
+@st.fragment
+def _chat_fragment(user_prompt):
+    """Handle Submit and render the chat history; widgets in here only rerun this fragment"""
     # Submit button
     if st.button("Submit Query", key="function_call_submit", type="primary"):
         if not user_prompt:
             st.warning("Please enter a prompt.")
             return
         
-        with st.spinner("Creating function call agent..."):
-            client, function_agent = create_function_call_agent(st.session_state.api_key)
+        with st.spinner("Preparing function call agent..."):
+            client, function_agent = get_or_create_function_call_agent(st.session_state.api_key)
+        
+        if not client or not function_agent:
+            return
+        
+        # Add the user message to the history
+        if 'function_calls_history' not in st.session_state:
+            st.session_state.function_calls_history = []
+        
+        # Add user message to history
+        st.session_state.function_calls_history.append({
+            "key": uuid4().hex[:10],
+            "role": "user",
+            "content": user_prompt
+        })
+        
+        try:
+            # Stream the conversation with the agent so text shows up as it is generated
+            turn = {"conversation_id": None, "text_parts": [], "tool_calls": {}}
+            placeholder = st.empty()
             
-            if not client or not function_agent:
-                return
+            with st.spinner("Processing your query... This may take a moment."):
+                stream = client.beta.conversations.start_stream(
+                    agent_id=function_agent.id,
+                    inputs=user_prompt
+                )
+                with placeholder.container():
+                    st.write_stream(stream_events(stream, turn, _HANDLERS))
             
-            # Add the user message to the history
-            if 'function_calls_history' not in st.session_state:
-                st.session_state.function_calls_history = []
+            # The streamed reply is re-rendered from history below
+            placeholder.empty()
             
-            # Add user message to history
-            st.session_state.function_calls_history.append({
-                "role": "user",
-                "content": user_prompt
-            })
+            # Initialize variables to track conversation flow
+            conversation_id = turn["conversation_id"]
+            current_response = "".join(turn["text_parts"])
+            function_results = []
+            result_append = function_results.append
+            text_parts = []
+            text_append = text_parts.append
             
-            try:
-                # Start a conversation with the agent
-                with st.spinner("Processing your query... This may take a moment."):
-                    response = client.beta.conversations.start(
-                        agent_id=function_agent.id,
-                        inputs=user_prompt
-                    )
-                
-                # Initialize variables to track conversation flow
-                conversation_id = response.conversation_id
-                current_response = ""
-                function_calls = []
-                function_results = []
-                final_response = ""
-                
-                # Process initial response and any function calls
-                for output in response.outputs:
-                    if hasattr(output, 'type') and output.type == "message.output":
-                        # Handle string content
-                        if isinstance(output.content, str):
-                            current_response += output.content
-                        # Handle list content
-                        elif isinstance(output.content, list):
-                            for content_item in output.content:
-                                # For dictionary items with get method
-                                if hasattr(content_item, 'get'):
-                                    if content_item.get("type") == "text":
-                                        current_response += content_item.get("text", "")
-                                # For objects without get method
-                                elif hasattr(content_item, 'type'):
-                                    # Handle text content
-                                    if content_item.type == "text" and hasattr(content_item, 'text'):
-                                        current_response += content_item.text
-                    
-                    elif hasattr(output, 'type') and output.type == "tool.calls":
-                        if hasattr(output, 'tool_calls'):
-                            for tool_call in output.tool_calls:
-                                if hasattr(tool_call, 'function') and tool_call.function:
-                                    # Extract function information safely
-                                    function_name = ""
-                                    function_args = {}
-                                    tool_call_id = ""
-                                    
-                                    if hasattr(tool_call, 'id'):
-                                        tool_call_id = tool_call.id
-                                        
-                                    if hasattr(tool_call.function, 'name'):
-                                        function_name = tool_call.function.name
-                                        
-                                    if hasattr(tool_call.function, 'arguments'):
-                                        try:
-                                            # Try to parse arguments as JSON
-                                            function_args = json.loads(tool_call.function.arguments)
-                                        except:
-                                            # If parsing fails, use as string
-                                            function_args = {"raw_args": tool_call.function.arguments}
-                                    
-                                    function_calls.append({
-                                        "tool_call_id": tool_call_id,
-                                        "function_name": function_name,
-                                        "arguments": function_args
-                                    })
+            # Turn the streamed function calls into executable calls
+            function_calls = [
+                {
+                    "tool_call_id": tool_call_id,
+                    "function_name": tool_call["name"],
+                    "arguments": _parse_arguments(tool_call["arguments"])
+                }
+                for tool_call_id, tool_call in turn["tool_calls"].items()
+            ]
+            
+            # Execute function calls and continue conversation
+            for function_call in function_calls:
+                function_name = function_call["function_name"]
+                args = function_call["arguments"]
                 
-                # Execute function calls and continue conversation
-                for function_call in function_calls:
-                    function_name = function_call["function_name"]
-                    args = function_call["arguments"]
-                    result = None
-                    
-                    # Execute the appropriate function
-                    if function_name == "get_interest_rate":
-                        region = args.get("region", "")
-                        date = args.get("date", None)
-                        result = get_interest_rate(region, date)
-                    
-                    elif function_name == "calculate_loan_payment":
-                        principal = args.get("principal", 0)
-                        annual_interest_rate = args.get("annual_interest_rate", 0)
-                        term_years = args.get("term_years", 0)
-                        result = calculate_loan_payment(principal, annual_interest_rate, term_years)
-                    
-                    if result:
-                        function_results.append({
-                            "tool_call_id": function_call["tool_call_id"],
-                            "function_name": function_name,
-                            "result": result
-                        })
-                        
-                        # Continue the conversation with the function result
-                        with st.spinner(f"Processing function result for {function_name}..."):
-                            continue_response = client.beta.conversations.continued(
-                                conversation_id=conversation_id,
-                                tool_call_id=function_call["tool_call_id"],
-                                result=json.dumps(result)
-                            )
-                            
-                            # Extract the final response
-                            for output in continue_response.outputs:
-                                if output.type == "message.output":
-                                    if isinstance(output.content, str):
-                                        final_response += output.content
-                                    elif isinstance(output.content, list):
-                                        for content_item in output.content:
-                                            if content_item.get("type") == "text":
-                                                final_response += content_item.get("text", "")
+                # Execute the appropriate function
+                result = run_tool(function_name, args)
                 
-                # If there were no function calls, use the initial response
-                if not function_calls:
-                    final_response = current_response
+                if result:
+                    result_append({
+                        "tool_call_id": function_call["tool_call_id"],
+                        "function_name": function_name,
+                        "result": result
+                    })
+            
+            # Continue the conversation with all function results at once
+            if function_results:
+                with st.spinner(f"Processing {len(function_results)} function result(s)..."):
+                    continue_response = continue_with_results(client, conversation_id, function_results)
                 
-                # Add agent response to history
-                st.session_state.function_calls_history.append({
-                    "role": "assistant",
-                    "content": final_response,
-                    "function_calls": function_calls,
-                    "function_results": function_results
-                })
+                # Extract the final response
+                for output in continue_response.outputs:
+                    if getattr(output, 'type', None) == "message.output":
+                        text_append(extract_text(output.content))
             
-            except Exception as e:
-                st.error(f"Error: {str(e)}")
-                # Add error message to history
-                st.session_state.function_calls_history.append({
-                    "role": "assistant",
-                    "content": f"Error: {str(e)}",
-                    "function_calls": [],
-                    "function_results": []
-                })
+            # If there were no function calls, use the initial response
+            final_response = "".join(text_parts) if function_calls else current_response
+            
+            # Add agent response to history
+            st.session_state.function_calls_history.append({
+                "key": uuid4().hex[:10],
+                "role": "assistant",
+                "content": final_response,
+                "function_calls": function_calls,
+                "function_results": function_results
+            })
+        
+        except Exception as e:
+            st.error(f"Error: {str(e)}")
+            # Add error message to history
+            st.session_state.function_calls_history.append({
+                "key": uuid4().hex[:10],
+                "role": "assistant",
+                "content": f"Error: {str(e)}",
+                "function_calls": [],
+                "function_results": []
+            })
+        
+        # Keep only the most recent messages
+        st.session_state.function_calls_history = st.session_state.function_calls_history[-CHAT_HISTORY_LIMIT:]
     
     # Display chat history
     st.markdown("### Conversation & Function Calls")
@@ -338,69 +431,49 @@ def display_function_calls_page():
     chat_container = st.container()
     
     with chat_container:
-        for message in st.session_state.function_calls_history:
-            is_user = message["role"] == "user"
-            
-            # Display the message
-            display_chat_message(message["content"], is_user)
-            
-            # Display function call details for assistant messages
-            if not is_user:
-                # Show function calls
-                if "function_calls" in message and message["function_calls"]:
-                    with st.expander("Function Calls", expanded=True):
-                        for i, call in enumerate(message["function_calls"]):
-                            st.markdown(f"**Function Call {i+1}:** {call['function_name']}")
-                            st.markdown("**Arguments:**")
-                            st.json(call["arguments"])
-                            st.markdown("---")
-                
-                # Show function results
-                if "function_results" in message and message["function_results"]:
-                    with st.expander("Function Results", expanded=True):
-                        for i, result in enumerate(message["function_results"]):
-                            st.markdown(f"**Function Result {i+1}:** {result['function_name']}")
-                            st.markdown("**Result:**")
-                            
-                            # Format the result as a table if it's a suitable type
-                            if result['function_name'] == "calculate_loan_payment":
-                                # Create a more user-friendly display for loan calculations
-                                loan_data = result['result']
-                                
-                                # Main metrics in columns
-                                col1, col2, col3 = st.columns(3)
-                                with col1:
-                                    st.metric("Monthly Payment", f"${loan_data['monthly_payment']}")
-                                with col2:
-                                    st.metric("Total Interest", f"${loan_data['total_interest']}")
-                                with col3:
-                                    st.metric("Total Payment", f"${loan_data['total_payment']}")
-                                
-                                # Additional details
-                                st.markdown(f"**Loan Details:**")
-                                st.markdown(f"- Principal: ${loan_data['principal']}")
-                                st.markdown(f"- Interest Rate: {loan_data['annual_interest_rate']}")
-                                st.markdown(f"- Term: {loan_data['term_years']} years ({loan_data['number_of_payments']} payments)")
-                                
-                            elif result['function_name'] == "get_interest_rate" and "error" not in result['result']:
-                                # Create a card-like display for interest rate
-                                rate_data = result['result']
-                                
-                                st.markdown(f"""
-                                <div style="padding: 15px; border-radius: 10px; background-color: #f0f7ff; margin-bottom: 10px;">
-                                    <h3 style="margin-top: 0;">{rate_data['central_bank']}</h3>
-                                    <h2 style="color: #1E88E5;">{rate_data['interest_rate']}</h2>
-                                    <p>Region: {rate_data['region']}</p>
-                                    <p>Last Updated: {rate_data['last_updated']}</p>
-                                </div>
-                                """, unsafe_allow_html=True)
-                            else:
-                                # Default to JSON display
-                                st.json(result["result"])
-                            
-                            st.markdown("---")
+        history = st.session_state.function_calls_history
+        
+        # Older messages are only rendered on request so reruns stay cheap in long sessions
+        earlier = history[:-CHAT_HISTORY_INLINE]
+        if earlier and st.toggle(f"Show {len(earlier)} earlier messages", key="show_earlier_function_calls"):
+            for message in earlier:
+                render_function_message(message)
+        
+        for message in history[-CHAT_HISTORY_INLINE:]:
+            render_function_message(message)
     
     # Clear history button
     if st.session_state.function_calls_history and st.button("Clear History", key="clear_function_calls_history"):
         st.session_state.function_calls_history = []
         st.rerun()
+
+def display_function_calls_page():
+    st.title("📞 Function Calls")
+    
+    # Rendered on full reruns only; Submit and history reruns stay inside _chat_fragment
+    st.markdown(_INTRO_MD)
+    
+    # API key check
+    if not st.session_state.api_key:
+        st.warning("Please enter your Mistral API Key in the sidebar to use this feature.")
+        return
+    
+    # Select example or custom prompt
+    prompt_type = st.radio(
+        "Choose a prompt type:",
+        ["Example Prompts", "Custom Prompt"],
+        index=0,
+        horizontal=True
+    )
+    
+    if prompt_type == "Example Prompts":
+        user_prompt = st.selectbox("Select an example prompt:", _EXAMPLES)
+    else:
+        user_prompt = st.text_area(
+            "Enter your custom prompt:",
+            placeholder="Example: What is the current interest rate in Australia?",
+            height=100
+        )
+    
+    # Submit and chat history rerun on their own when the buttons are clicked
+    _chat_fragment(user_prompt)
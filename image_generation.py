@@ -1,212 +1,192 @@
 import streamlit as st
-import json
-import base64
 import io
 from PIL import Image
-from mistralai import Mistral
-from utils import copy_to_clipboard, download_image_button, display_chat_message
+from concurrent.futures import ThreadPoolExecutor
+from uuid import uuid4
+from utils import download_image_button, display_chat_message, get_cached_agent, get_mistral_client, parse_message_output, run_agent_page, IMAGE_BLOB_LIMIT
 
 def create_image_agent(api_key):
     """Create an image generation agent using Mistral API"""
+    client = get_mistral_client(api_key)
+    
+    image_agent = client.beta.agents.create(
+        model="mistral-medium-latest",
+        name="Image Generation Agent",
+        description="Agent used to generate images based on text prompts.",
+        instructions="Use the image generation tool when you have to create images. "
+                    "You're excellent at generating detailed, high-quality images from user prompts.",
+        tools=[{"type": "image_generation"}],
+        completion_args={
+            "temperature": 0.7,
+            "top_p": 0.95
+        }
+    )
+    
+    return client, image_agent
+
+def get_or_create_image_agent(api_key):
+    """Return the image generation agent for this API key, creating it on first use"""
+    return get_cached_agent(create_image_agent, api_key, "image generation agent")
+
+def _handle_image_file(parsed, item_type, field):
+    """Remember the file produced by the image generation tool"""
+    if item_type == "tool_file":
+        parsed["image"] = (field("file_id", None), field("file_name", None), field("file_type", None))
+
+_TOOL_HANDLERS = {"image_generation": _handle_image_file}
+
+def _generate_one(client, agent_id, prompt, i):
+    """Generate one image, returning its history entry, the image file id and any error to show"""
+    # Runs in a worker thread, so errors are returned rather than shown with st.error
     try:
-        client = Mistral(api_key=api_key)
-        
-        image_agent = client.beta.agents.create(
-            model="mistral-medium-latest",
-            name="Image Generation Agent",
-            description="Agent used to generate images based on text prompts.",
-            instructions="Use the image generation tool when you have to create images. "
-                        "You're excellent at generating detailed, high-quality images from user prompts.",
-            tools=[{"type": "image_generation"}],
-            completion_args={
-                "temperature": 0.7,
-                "top_p": 0.95
-            }
+        # Start a conversation with the agent
+        response = client.beta.conversations.start(
+            agent_id=agent_id,
+            inputs=prompt
         )
         
-        return client, image_agent
+        # Extract and process the agent's response
+        parsed = parse_message_output(response.outputs, _TOOL_HANDLERS)
+        response_text = parsed["text"]
+        image_file_id, image_file_name, image_file_type = parsed.get("image", (None, None, None))
+        
+        # The image itself is downloaded afterwards, together with the others
+        return {
+            "key": uuid4().hex[:10],
+            "role": "assistant",
+            "content": response_text if response_text else f"Here is generated image {i+1}",
+            "image_file_name": image_file_name,
+            "image_file_type": image_file_type
+        }, image_file_id, None
+    
     except Exception as e:
-        st.error(f"Failed to create image generation agent: {str(e)}")
-        return None, None
+        return {
+            "key": uuid4().hex[:10],
+            "role": "assistant",
+            "content": f"Error generating image {i+1}: {str(e)}"
+        }, None, f"Error generating image {i+1}: {str(e)}"
 
-def display_image_generation_page():
-    st.title("🖼️ Image Generation Agent")
-    
-    st.markdown("""
-    The Image Generation agent allows you to create diverse and detailed images based on text prompts.
-    Powered by Black Forest Lab FLUX1.1 [pro] Ultra, this agent can generate a wide range of visual content.
-    
-    ### Capabilities:
-    - Creating artistic images and illustrations
-    - Generating visual aids for educational content
-    - Designing custom graphics for marketing materials
-    - Visualizing concepts and ideas
+def _download_batch(client, file_ids):
+    """Download files concurrently, returning the contents and the errors keyed by file id"""
+    def download(file_id):
+        try:
+            return client.files.download(file_id=file_id).read(), None
+        except Exception as e:
+            return None, e
     
-    Try it out with descriptive prompts for the kinds of images you want to generate.
-    """)
-    
-    # API key check
-    if not st.session_state.api_key:
-        st.warning("Please enter your Mistral API Key in the sidebar to use this feature.")
-        return
-    
-    # Example prompts
-    examples = [
-        "A futuristic city with flying cars and neon lights at sunset.",
-        "A serene mountain landscape with a crystal clear lake reflecting the sky.",
-        "An orange cat wearing a business suit in an office.",
-        "A steampunk-style robot playing a violin on a Victorian street.",
-        "A magical library with floating books and glowing orbs of light."
-    ]
-    
-    # Select example or custom prompt
-    prompt_type = st.radio(
-        "Choose a prompt type:",
-        ["Example Prompts", "Custom Prompt"],
-        index=0,
-        horizontal=True
-    )
+    blobs = {}
+    errors = {}
+    with ThreadPoolExecutor(max_workers=len(file_ids)) as executor:
+        for file_id, (data, error) in zip(file_ids, executor.map(download, file_ids)):
+            if error is None:
+                blobs[file_id] = data
+            else:
+                errors[file_id] = error
+    return blobs, errors
+
+@st.cache_resource(show_spinner=False, max_entries=50)
+def _decode_png(data):
+    """Decode image bytes once per distinct image; the shared image is only read, never modified"""
+    image = Image.open(io.BytesIO(data))
+    image.load()
+    return image
+
+_INTRO_MD = """
+The Image Generation agent allows you to create diverse and detailed images based on text prompts.
+Powered by Black Forest Lab FLUX1.1 [pro] Ultra, this agent can generate a wide range of visual content.
+
+### Capabilities:
+- Creating artistic images and illustrations
+- Generating visual aids for educational content
+- Designing custom graphics for marketing materials
+- Visualizing concepts and ideas
+
+Try it out with descriptive prompts for the kinds of images you want to generate.
+"""
+
+_EXAMPLES = (
+    "A futuristic city with flying cars and neon lights at sunset.",
+    "A serene mountain landscape with a crystal clear lake reflecting the sky.",
+    "An orange cat wearing a business suit in an office.",
+    "A steampunk-style robot playing a violin on a Victorian street.",
+    "A magical library with floating books and glowing orbs of light."
+)
+
+def _run_generation(client, image_agent, user_prompt, history):
+    """Generate the images, store their bytes and add the replies to the history"""
+    # Generate the images concurrently; each one is an independent conversation
+    num_images_to_generate = 2
+    with st.spinner(f"Generating {num_images_to_generate} images in parallel... This may take a moment."):
+        with ThreadPoolExecutor(max_workers=num_images_to_generate) as executor:
+            futures = [
+                executor.submit(_generate_one, client, image_agent.id, user_prompt, i)
+                for i in range(num_images_to_generate)
+            ]
+            results = [future.result() for future in futures]
     
-    if prompt_type == "Example Prompts":
-        user_prompt = st.selectbox("Select an example prompt:", examples)
-    else:
-        user_prompt = st.text_area(
-            "Enter your custom prompt:",
-            placeholder="Example: A beautiful Japanese garden with cherry blossoms and a small bridge over a koi pond.",
-            height=100
-        )
+    # Download every generated image in one concurrent batch
+    file_ids = [file_id for _, file_id, _ in results if file_id]
+    blobs, download_errors = {}, {}
+    if file_ids:
+        with st.spinner(f"Downloading {len(file_ids)} generated image(s)..."):
+            blobs, download_errors = _download_batch(client, file_ids)
     
-    # Submit button
-    if st.button("Generate Image", key="image_submit", type="primary"):
-        if not user_prompt:
-            st.warning("Please enter a prompt.")
-            return
+    # Add agent responses to history in order
+    image_blobs = st.session_state.image_blobs
+    for i, (entry, file_id, error) in enumerate(results):
+        if error:
+            st.error(error)
+        if file_id in download_errors:
+            st.error(f"Failed to download image {i+1}/{num_images_to_generate}: {str(download_errors[file_id])}")
         
-        with st.spinner("Creating image generation agent..."):
-            client, image_agent = create_image_agent(st.session_state.api_key)
-            
-            if not client or not image_agent:
-                return
-            
-            # Add the user message to the history
-            if 'image_generation_history' not in st.session_state:
-                st.session_state.image_generation_history = []
-            
-            # Add user message to history
-            st.session_state.image_generation_history.append({
-                "role": "user",
-                "content": user_prompt
-            })
-            
-            # Loop to generate at least two images
-            num_images_to_generate = 2
-            for i in range(num_images_to_generate):
-                try:
-                    # Start a conversation with the agent
-                    with st.spinner(f"Generating image {i+1}/{num_images_to_generate}... This may take a moment."):
-                        response = client.beta.conversations.start(
-                            agent_id=image_agent.id,
-                            inputs=user_prompt
-                        )
-                    
-                    # Extract and process the agent's response
-                    response_text = ""
-                    image_file_id = None
-                    image_file_name = None
-                    image_file_type = None
-                    
-                    for output in response.outputs:
-                        if hasattr(output, 'type') and output.type == "message.output":
-                            # Handle string content
-                            if isinstance(output.content, str):
-                                response_text += output.content
-                            # Handle list content
-                            elif isinstance(output.content, list):
-                                for content_item in output.content:
-                                    # For dictionary items with get method
-                                    if hasattr(content_item, 'get'):
-                                        if content_item.get("type") == "text":
-                                            response_text += content_item.get("text", "")
-                                        elif content_item.get("type") == "tool_file" and content_item.get("tool") == "image_generation":
-                                            image_file_id = content_item.get("file_id")
-                                            image_file_name = content_item.get("file_name")
-                                            image_file_type = content_item.get("file_type")
-                                    # For objects without get method
-                                    elif hasattr(content_item, 'type'):
-                                        # Handle text content
-                                        if content_item.type == "text" and hasattr(content_item, 'text'):
-                                            response_text += content_item.text
-                                        # Handle tool_file content
-                                        elif content_item.type == "tool_file" and hasattr(content_item, 'tool'):
-                                            if content_item.tool == "image_generation":
-                                                if hasattr(content_item, 'file_id'):
-                                                    image_file_id = content_item.file_id
-                                                if hasattr(content_item, 'file_name'):
-                                                    image_file_name = content_item.file_name
-                                                if hasattr(content_item, 'file_type'):
-                                                    image_file_type = content_item.file_type
-                    
-                    # Download the image if file_id is available
-                    image_data = None
-                    if image_file_id:
-                        with st.spinner(f"Downloading generated image {i+1}/{num_images_to_generate}..."):
-                            try:
-                                file_response = client.files.download(file_id=image_file_id)
-                                image_data = file_response.read()
-                            except Exception as e:
-                                st.error(f"Failed to download image {i+1}/{num_images_to_generate}: {str(e)}")
-                    
-                    # Add agent response to history
-                    st.session_state.image_generation_history.append({
-                        "role": "assistant",
-                        "content": response_text if response_text else f"Here is generated image {i+1}",
-                        "image_data": image_data,
-                        "image_file_name": image_file_name,
-                        "image_file_type": image_file_type
-                    })
-                
-                except Exception as e:
-                    st.error(f"Error generating image {i+1}: {str(e)}")
-                    # Add error message to history
-                    st.session_state.image_generation_history.append({
-                        "role": "assistant",
-                        "content": f"Error generating image {i+1}: {str(e)}",
-                        "image_data": None
-                    })
+        # History only references the image; the bytes go to the bounded blob store
+        if file_id in blobs:
+            image_blobs[file_id] = blobs[file_id]
+            entry["file_id"] = file_id
+        history.append(entry)
     
-    # Display chat history
-    st.markdown("### Conversation & Generated Images")
+    # Drop the oldest images beyond the limit
+    while len(image_blobs) > IMAGE_BLOB_LIMIT:
+        image_blobs.popitem(last=False)
+
+def _render_image_message(message):
+    """Render one chat message with its generated image"""
+    is_user = message["role"] == "user"
     
-    # Create a chat container with scrolling
-    chat_container = st.container()
+    # Display the message
+    display_chat_message(message["content"], is_user, key=message["key"])
     
-    with chat_container:
-        for message in st.session_state.image_generation_history:
-            is_user = message["role"] == "user"
+    # Display image for assistant messages
+    image_data = st.session_state.image_blobs.get(message.get("file_id"))
+    if not is_user and message.get("file_id") and image_data is None:
+        st.caption("This image is no longer kept in the session.")
+    elif not is_user and image_data:
+        try:
+            # Convert bytes to PIL Image
+            image = _decode_png(image_data)
             
-            # Display the message
-            display_chat_message(message["content"], is_user)
+            # Display the image
+            st.image(image, caption="Generated Image", use_container_width=True)
             
-            # Display image for assistant messages
-            if not is_user and "image_data" in message and message["image_data"]:
-                try:
-                    # Create a unique key for this image
-                    image_key = f"img_{hash(message['content'])}"
-                    
-                    # Convert bytes to PIL Image
-                    image = Image.open(io.BytesIO(message["image_data"]))
-                    
-                    # Display the image
-                    st.image(image, caption="Generated Image", use_container_width=True)
-                    
-                    # Add download button for the image
-                    if message.get("image_file_name") and message.get("image_file_type"):
-                        filename = f"{message['image_file_name']}.{message['image_file_type']}"
-                        download_image_button(message["image_data"], filename, "Download Image")
-                except Exception as e:
-                    st.error(f"Error displaying image: {str(e)}")
-    
-    # Clear history button
-    if st.session_state.image_generation_history and st.button("Clear History", key="clear_image_history"):
-        st.session_state.image_generation_history = []
-        st.rerun()
+            # Add download button for the image
+            if message.get("image_file_name") and message.get("image_file_type"):
+                filename = f"{message['image_file_name']}.{message['image_file_type']}"
+                download_image_button(image_data, filename, "Download Image", key=f"download_image_{message['key']}")
+        except Exception as e:
+            st.error(f"Error displaying image: {str(e)}")
+
+def display_image_generation_page():
+    run_agent_page(
+        title="🖼️ Image Generation Agent",
+        description=_INTRO_MD,
+        examples=_EXAMPLES,
+        placeholder="Example: A beautiful Japanese garden with cherry blossoms and a small bridge over a koi pond.",
+        submit_label="Generate Image",
+        history_key="image_generation_history",
+        history_title="Conversation & Generated Images",
+        create_agent_fn=get_or_create_image_agent,
+        run_fn=_run_generation,
+        render_fn=_render_image_message,
+        agent_name="image generation agent",
+        on_clear=st.session_state.image_blobs.clear
+    )
@@ -0,0 +1,28 @@
+import os
+
+# Example prompts offered on the page; also precomputed by precompute_examples.py
+EXAMPLES = [
+    "What are the current interest rates and how would they affect my investments over the next 5 years?",
+    "Compare the performance of tech stocks versus energy stocks over the past year and create a graph.",
+    "What is compound interest and how much would $10,000 grow to in 10 years at the current average savings rate?",
+    "What are the best retirement investment strategies given the current economic outlook?",
+    "Analyze the current inflation rate and show how it impacts different asset classes."
+]
+
+# Responses to EXAMPLES written by precompute_examples.py, keyed by prompt text
+EXAMPLES_CACHE_PATH = os.path.join(os.path.dirname(os.path.abspath(__file__)), "examples_cache.json")
+
+# Context shared by every agent. It is kept byte-identical at the start of each agent's
+# instructions so providers with prefix caching can reuse it across handoffs.
+SHARED_PREFIX = (
+    "You are part of a team of financial agents answering a user's finance questions. "
+    "Be accurate, state your assumptions, and present figures and dates clearly.\n\n"
+)
+
+FINANCE_INSTRUCTIONS = SHARED_PREFIX + (
+    "You're an expert in finance who can analyze financial data, provide investment advice, "
+    "and explain financial concepts. You can hand off specialized tasks to other agents."
+)
+WEB_SEARCH_INSTRUCTIONS = SHARED_PREFIX + "You search the web for the latest financial data and market information."
+CALCULATOR_INSTRUCTIONS = SHARED_PREFIX + "You perform financial calculations using the code interpreter."
+GRAPH_INSTRUCTIONS = SHARED_PREFIX + "You create graphs and visualizations of financial data."
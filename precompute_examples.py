@@ -0,0 +1,80 @@
+"""Precompute answers to the Agent Orchestration example prompts with the Mistral Batch API.
+
+Batch jobs are billed at a discount and run asynchronously, so the canned demo prompts can be
+answered once offline. Run `python precompute_examples.py` with MISTRAL_API_KEY set (or in .env);
+the app then serves matching example prompts from examples_cache.json without calling the API.
+"""
+import json
+import os
+import time
+from dotenv import load_dotenv
+from mistralai import Mistral
+from orchestration_prompts import EXAMPLES, EXAMPLES_CACHE_PATH, FINANCE_INSTRUCTIONS
+
+BATCH_MODEL = "mistral-small-latest"
+POLL_INTERVAL_SECONDS = 10
+FINISHED_STATUSES = {"SUCCESS", "FAILED", "TIMEOUT_EXCEEDED", "CANCELLED"}
+
+def build_batch_input():
+    """Build the batch input file: one chat completion request per example prompt"""
+    lines = []
+    for i, prompt in enumerate(EXAMPLES):
+        lines.append(json.dumps({
+            "custom_id": str(i),
+            "body": {
+                "messages": [
+                    {"role": "system", "content": FINANCE_INSTRUCTIONS},
+                    {"role": "user", "content": prompt}
+                ],
+                "temperature": 0.3,
+                "top_p": 0.95
+            }
+        }))
+    return "\n".join(lines).encode("utf-8")
+
+def parse_batch_output(content):
+    """Map each example prompt to the response text found in the batch output file"""
+    responses = {}
+    for line in content.decode("utf-8").splitlines():
+        if not line.strip():
+            continue
+        record = json.loads(line)
+        body = (record.get("response") or {}).get("body") or {}
+        choices = body.get("choices") or []
+        if choices:
+            responses[EXAMPLES[int(record["custom_id"])]] = choices[0]["message"]["content"]
+    return responses
+
+def main():
+    load_dotenv()
+    client = Mistral(api_key=os.getenv("MISTRAL_API_KEY", ""))
+
+    # Upload the requests and start the batch job
+    batch_file = client.files.upload(
+        file={"file_name": "examples_batch.jsonl", "content": build_batch_input()},
+        purpose="batch"
+    )
+    job = client.batch.jobs.create(
+        input_files=[batch_file.id],
+        model=BATCH_MODEL,
+        endpoint="/v1/chat/completions",
+        metadata={"job_type": "examples_cache"}
+    )
+    print(f"Started batch job {job.id}")
+
+    # Batch jobs are asynchronous, so poll until the job finishes
+    while job.status not in FINISHED_STATUSES:
+        time.sleep(POLL_INTERVAL_SECONDS)
+        job = client.batch.jobs.get(job_id=job.id)
+        print(f"Job status: {job.status} ({job.succeeded_requests}/{job.total_requests} succeeded)")
+
+    if job.status != "SUCCESS" or not job.output_file:
+        raise SystemExit(f"Batch job {job.id} finished with status {job.status}")
+
+    responses = parse_batch_output(client.files.download(file_id=job.output_file).read())
+    with open(EXAMPLES_CACHE_PATH, "w", encoding="utf-8") as f:
+        json.dump(responses, f, indent=2)
+    print(f"Wrote {len(responses)} cached responses to {EXAMPLES_CACHE_PATH}")
+
+if __name__ == "__main__":
+    main()
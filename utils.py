@@ -1,73 +1,268 @@
-import base64
+import hashlib
+import html
 import json
 import os
 import streamlit as st
-from typing import Dict, Any, List, Optional, Union
-import pandas as pd
-import plotly.express as px
-import plotly.graph_objects as go
-from datetime import datetime
-import matplotlib.pyplot as plt
+import string
+from typing import Dict, Any, List, Optional
 from PIL import Image
 import io
+from collections import OrderedDict, deque
+from functools import partial
+from uuid import uuid4
+import httpx
+from mistralai import Mistral
+
+# Number of orchestration messages kept in session state for display
+ORCHESTRATION_HISTORY_LIMIT = 20
+
+# Number of chat messages kept per page, and how many of the newest are rendered inline
+CHAT_HISTORY_LIMIT = 40
+CHAT_HISTORY_INLINE = 10
+
+# Number of generated images whose bytes are kept in session state
+IMAGE_BLOB_LIMIT = 10
+
+# Per-request timeout for Mistral calls; the SDK overrides any timeout set on the HTTP client
+MISTRAL_TIMEOUT_MS = 300_000
+
+@st.cache_resource(show_spinner=False)
+def _http_client():
+    """Create one pooled HTTP client shared by every Mistral client in this process"""
+    return httpx.Client(
+        limits=httpx.Limits(max_keepalive_connections=20, max_connections=50)
+    )
+
+def get_mistral_client(api_key):
+    """Create a Mistral client that reuses the shared HTTP connection pool"""
+    return Mistral(api_key=api_key, client=_http_client(), timeout_ms=MISTRAL_TIMEOUT_MS)
+
+@st.cache_resource(show_spinner=False)
+def _cached_agent(create_fn_name, api_key_hash, options, _create_fn, _api_key):
+    """Run an agent factory once per factory, API key and options"""
+    return _create_fn(_api_key, **dict(options))
+
+# Function to get an agent, creating it once per API key
+def get_cached_agent(create_fn, api_key: str, label: str, empty: tuple = (None, None), **options):
+    """
+    Returns what create_fn builds for this API key, sharing it across reruns and sessions
+    
+    Args:
+        create_fn: Agent factory called as create_fn(api_key, **options); raises on failure
+        api_key: The Mistral API key, which is cached by its hash rather than in the clear
+        label: What is being created, used in the error message
+        empty: Returned instead when creation fails, shaped like create_fn's result
+        options: Extra hashable arguments for create_fn; each combination is cached separately
+    """
+    key = hashlib.sha256(api_key.encode()).hexdigest()
+    try:
+        return _cached_agent(f"{create_fn.__module__}.{create_fn.__qualname__}", key,
+                             tuple(sorted(options.items())), create_fn, api_key)
+    except Exception as e:
+        st.error(f"Failed to create {label}: {str(e)}")
+        return empty
+
+# Function to parse the message outputs of a conversation response
+def parse_message_output(outputs, tool_handlers: Dict[str, Any]) -> Dict[str, Any]:
+    """
+    Collects the text of message outputs and passes tool chunks to the handler for their tool
+    
+    Args:
+        outputs: The outputs of a conversation response
+        tool_handlers: Maps a tool name to handler(parsed, item_type, field), where field(name, default)
+            reads a field of the chunk whether it is a dict or an SDK object
+    
+    Returns:
+        A dict with the joined "text" plus whatever the handlers added
+    """
+    parsed = {}
+    text_parts = []
+    text_append = text_parts.append
+    
+    for output in outputs:
+        if getattr(output, 'type', None) != "message.output":
+            continue
+        
+        content = output.content
+        if isinstance(content, str):
+            text_append(content)
+            continue
+        
+        if not content:
+            continue
+        
+        # A response's chunks are all dicts or all SDK objects, so pick the access path once
+        if isinstance(content[0], dict):
+            for item in content:
+                item_type = item.get("type")
+                if item_type == "text":
+                    text_append(item.get("text", ""))
+                else:
+                    handler = tool_handlers.get(item.get("tool"))
+                    if handler:
+                        handler(parsed, item_type, item.get)
+        else:
+            for item in content:
+                item_type = getattr(item, 'type', None)
+                if item_type == "text":
+                    text_append(getattr(item, 'text', ""))
+                else:
+                    handler = tool_handlers.get(getattr(item, 'tool', None))
+                    if handler:
+                        handler(parsed, item_type, partial(getattr, item))
+    
+    parsed["text"] = "".join(text_parts)
+    return parsed
+
+# Function to stream the message text of a conversation response
+def stream_message_output(stream, parsed: Dict[str, Any], tool_handlers: Dict[str, Any]):
+    """
+    Yields the text of streamed message deltas for st.write_stream, passing tool chunks to the
+    handler for their tool as in parse_message_output
+    
+    Args:
+        stream: The event stream of a conversation
+        parsed: A dict the handlers add to; the joined "text" is stored once the stream ends
+        tool_handlers: Maps a tool name to handler(parsed, item_type, field)
+    """
+    text_parts = []
+    text_append = text_parts.append
+    
+    for event in stream:
+        data = event.data
+        if getattr(data, 'type', None) != "message.output.delta":
+            continue
+        
+        content = data.content
+        if isinstance(content, str):
+            text_append(content)
+            yield content
+            continue
+        
+        # Each delta carries a single chunk
+        field = content.get if isinstance(content, dict) else partial(getattr, content)
+        item_type = field("type", None)
+        if item_type == "text":
+            text = field("text", "")
+            text_append(text)
+            yield text
+        else:
+            handler = tool_handlers.get(field("tool", None))
+            if handler:
+                handler(parsed, item_type, field)
+    
+    parsed["text"] = "".join(text_parts)
+
+# Function to extract the text of message content
+def extract_text(content) -> str:
+    """
+    Returns the text of message content, skipping tool file chunks and other non-text chunks
+    
+    Args:
+        content: A string, a single chunk (dict or SDK object) or a list of chunks
+    """
+    if isinstance(content, str):
+        return content
+    if isinstance(content, list):
+        return "".join(extract_text(content_item) for content_item in content)
+    if isinstance(content, dict):
+        return content.get("text", "") if content.get("type") == "text" else ""
+    return content.text if getattr(content, 'type', None) == "text" else ""
+
+# Function to handle a streamed message delta
+def handle_message_delta(data, turn: Dict[str, Any]) -> str:
+    """
+    Collects the text of a message delta into turn["text_parts"] and returns it so it can be written out;
+    the usual "message.output.delta" handler for stream_events
+    
+    Args:
+        data: The data of a "message.output.delta" event
+        turn: A dict holding the turn's "text_parts" list
+    """
+    text = extract_text(data.content)
+    turn["text_parts"].append(text)
+    return text
+
+# Function to dispatch the events of a conversation stream
+def stream_events(stream, turn: Dict[str, Any], handlers: Dict[str, Any]):
+    """
+    Passes each stream event to the handler for its type and yields any text the handler returns,
+    for st.write_stream
+    
+    Args:
+        stream: The event stream of a conversation
+        turn: A dict the handlers collect the turn's state into
+        handlers: Maps an event type to handler(event.data, turn)
+    """
+    for event in stream:
+        handler = handlers.get(getattr(event.data, 'type', None))
+        if handler:
+            text = handler(event.data, turn)
+            if text:
+                yield text
+
+# Clipboard button markup, filled in per call with the JSON-escaped text and a unique key
+_COPY_TEMPLATE = string.Template("""
+<script>
+function copyToClipboard$key() {
+    const el = document.createElement('textarea');
+    el.value = $payload;
+    document.body.appendChild(el);
+    el.select();
+    document.execCommand('copy');
+    document.body.removeChild(el);
+    
+    // Show a toast notification
+    const toast = document.createElement('div');
+    toast.style.position = 'fixed';
+    toast.style.bottom = '20px';
+    toast.style.left = '50%';
+    toast.style.transform = 'translateX(-50%)';
+    toast.style.backgroundColor = '#4CAF50';
+    toast.style.color = 'white';
+    toast.style.padding = '16px';
+    toast.style.borderRadius = '4px';
+    toast.style.zIndex = '1000';
+    toast.innerHTML = 'Copied to clipboard!';
+    document.body.appendChild(toast);
+    
+    // Remove the toast after 2 seconds
+    setTimeout(() => {
+        toast.style.opacity = '0';
+        toast.style.transition = 'opacity 0.5s';
+        setTimeout(() => document.body.removeChild(toast), 500);
+    }, 2000);
+}
+</script>
+<button 
+    onclick="copyToClipboard$key()" 
+    style="background-color: #4CAF50; color: white; border: none; padding: 8px 16px; text-align: center; text-decoration: none; display: inline-block; font-size: 14px; margin: 4px 2px; cursor: pointer; border-radius: 4px;"
+>
+    $button_text
+</button>
+""")
 
 # Function to copy text to clipboard using JavaScript
-def copy_to_clipboard(text: str, button_text: str = "Copy to clipboard"):
+def copy_to_clipboard(text: str, button_text: str = "Copy to clipboard", key: Optional[str] = None):
     """
     Creates a button that copies the provided text to clipboard when clicked.
     
     Args:
         text: The text to copy to clipboard
         button_text: The text to display on the button
+        key: A stable unique key for the button, e.g. the key stored with its message
     """
     if text:
         # Create a unique key for this button
-        unique_key = f"copy_btn_{abs(hash(text)) % 10000}"
+        unique_key = f"copy_btn_{key}" if key else f"copy_btn_{abs(hash(text))}"
         
-        # JavaScript to copy text to clipboard
-        js_code = f"""
-        <script>
-        function copyToClipboard{unique_key}() {{
-            const el = document.createElement('textarea');
-            el.value = `{text.replace('`', '\\`')}`;
-            document.body.appendChild(el);
-            el.select();
-            document.execCommand('copy');
-            document.body.removeChild(el);
-            
-            // Show a toast notification
-            const toast = document.createElement('div');
-            toast.style.position = 'fixed';
-            toast.style.bottom = '20px';
-            toast.style.left = '50%';
-            toast.style.transform = 'translateX(-50%)';
-            toast.style.backgroundColor = '#4CAF50';
-            toast.style.color = 'white';
-            toast.style.padding = '16px';
-            toast.style.borderRadius = '4px';
-            toast.style.zIndex = '1000';
-            toast.innerHTML = 'Copied to clipboard!';
-            document.body.appendChild(toast);
-            
-            // Remove the toast after 2 seconds
-            setTimeout(() => {{
-                toast.style.opacity = '0';
-                toast.style.transition = 'opacity 0.5s';
-                setTimeout(() => document.body.removeChild(toast), 500);
-            }}, 2000);
-        }}
-        </script>
-        <button 
-            onclick="copyToClipboard{unique_key}()" 
-            style="background-color: #4CAF50; color: white; border: none; padding: 8px 16px; text-align: center; text-decoration: none; display: inline-block; font-size: 14px; margin: 4px 2px; cursor: pointer; border-radius: 4px;"
-        >
-            {button_text}
-        </button>
-        """
+        # JSON-escape the text, and keep "</" from closing the script tag early
+        payload = json.dumps(text).replace("</", "<\\/")
+        js_code = _COPY_TEMPLATE.safe_substitute(key=unique_key, payload=payload, button_text=html.escape(button_text))
         st.components.v1.html(js_code, height=50)
 
 # Function to create a download button for text content
-def download_button(content: str, file_name: str, button_text: str):
+def download_button(content: str, file_name: str, button_text: str, key: Optional[str] = None):
     """
     Creates a download button for the provided content
     
@@ -75,13 +270,12 @@ def download_button(content: str, file_name: str, button_text: str):
         content: The content to download
         file_name: The name of the file to download
         button_text: The text to display on the button
+        key: A unique widget key, needed when several buttons share a label and file name
     """
-    b64 = base64.b64encode(content.encode()).decode()
-    href = f'<a href="data:file/txt;base64,{b64}" download="{file_name}" style="background-color: #008CBA; color: white; border: none; padding: 8px 16px; text-align: center; text-decoration: none; display: inline-block; font-size: 14px; margin: 4px 2px; cursor: pointer; border-radius: 4px;">{button_text}</a>'
-    st.markdown(href, unsafe_allow_html=True)
+    st.download_button(button_text, data=content, file_name=file_name, mime="text/plain", key=key)
 
 # Function to download images
-def download_image_button(image_data, file_name, button_text="Download Image"):
+def download_image_button(image_data, file_name, button_text="Download Image", key=None):
     """
     Creates a download button for image data
     
@@ -89,6 +283,7 @@ def download_image_button(image_data, file_name, button_text="Download Image"):
         image_data: The image data as bytes or PIL Image
         file_name: The name of the file to download
         button_text: The text to display on the button
+        key: A unique widget key, needed when several buttons share a label and file name
     """
     if isinstance(image_data, Image.Image):
         buf = io.BytesIO()
@@ -96,72 +291,35 @@ def download_image_button(image_data, file_name, button_text="Download Image"):
         image_bytes = buf.getvalue()
     else:
         image_bytes = image_data
-        
-    b64 = base64.b64encode(image_bytes).decode()
-    href = f'<a href="data:image/png;base64,{b64}" download="{file_name}" style="background-color: #008CBA; color: white; border: none; padding: 8px 16px; text-align: center; text-decoration: none; display: inline-block; font-size: 14px; margin: 4px 2px; cursor: pointer; border-radius: 4px;">{button_text}</a>'
-    st.markdown(href, unsafe_allow_html=True)
-
-# Custom styling for chat messages
-def message_styling(is_user: bool):
-    """Returns the styling for a chat message based on whether it's from the user or the AI"""
-    if is_user:
-        return {
-            "background-color": "#F0F2F6",
-            "border-radius": "10px",
-            "padding": "10px",
-            "margin": "5px 0",
-            "max-width": "80%",
-            "align-self": "flex-end",
-            "font-family": "Arial, sans-serif"
-        }
-    else:
-        return {
-            "background-color": "#E1F5FE",
-            "border-radius": "10px",
-            "padding": "10px",
-            "margin": "5px 0",
-            "max-width": "80%",
-            "align-self": "flex-start",
-            "font-family": "Arial, sans-serif"
-        }
+    
+    # Served through Streamlit's media endpoint instead of a base64 data URI in the page
+    st.download_button(button_text, data=image_bytes, file_name=file_name, mime="image/png", key=key)
 
 # Function to display chat messages
-def display_chat_message(message, is_user: bool, with_copy_button: bool = True):
+def display_chat_message(message, is_user: bool, with_copy_button: bool = True, key: Optional[str] = None):
     """
-    Displays a chat message with proper styling
+    Displays a chat message in a native Streamlit chat bubble
     
     Args:
         message: The message content (can be a string or other object)
         is_user: Whether the message is from the user (True) or AI (False)
         with_copy_button: Whether to include a copy button (default: True)
+        key: A unique key for the message, used for its download button
     """
-    style = message_styling(is_user)
-    
-    # Convert the style dict to inline CSS
-    style_str = "; ".join([f"{k}: {v}" for k, v in style.items()])
-    
     # Ensure message is a string
-    if not isinstance(message, str):
-        try:
-            # Try to convert to string if it's not already
-            message_str = str(message)
-        except Exception:
-            message_str = "[Content cannot be displayed as text]"
-    else:
-        message_str = message
-    
-    # Create the HTML for the message container
-    msg_html = f'<div style="{style_str}">{message_str}</div>'
-    st.markdown(msg_html, unsafe_allow_html=True)
+    message_str = message if type(message) is str else str(message)
     
-    # Add copy and download buttons for AI messages
-    if not is_user and with_copy_button and isinstance(message, str) and message.strip():
-        col1, col2 = st.columns(2)
-        with col1:
-            # Use a safe text value for copy operations
-            copy_to_clipboard(message_str, "Copy Response")
-        with col2:
-            download_button(message_str, "response.txt", "Download Response")
+    with st.chat_message("user" if is_user else "assistant"):
+        st.markdown(message_str)
+        
+        # Add copy and download buttons for AI messages
+        if not is_user and with_copy_button and isinstance(message, str) and message.strip():
+            col1, col2 = st.columns(2)
+            with col1:
+                # Use a safe text value for copy operations
+                copy_to_clipboard(message_str, "Copy Response", key=key)
+            with col2:
+                download_button(message_str, "response.txt", "Download Response", key=f"download_{key}" if key else None)
 
 # Helper function to create styled expanders
 def styled_expander(title, expanded=False):
@@ -172,26 +330,114 @@ def styled_expander(title, expanded=False):
         title: The title of the expander
         expanded: Whether the expander is expanded by default
     """
-    # Custom CSS for the expander
-    st.markdown("""
-    <style>
-    .styled-expander {
-        border: 1px solid #e0e0e0;
-        border-radius: 8px;
-        padding: 10px;
-        margin: 10px 0;
-        background-color: #f9f9f9;
-    }
-    .styled-expander-header {
-        font-weight: bold;
-        cursor: pointer;
-        padding: 5px;
-    }
-    </style>
-    """, unsafe_allow_html=True)
-    
+    # The expander CSS lives in static/styles.css, which app.py injects once per run
     return st.expander(title, expanded=expanded)
 
+@st.fragment
+def _agent_history_fragment(history_key: str, history_title: str, render_fn, on_clear=None):
+    """Render an agent page's chat history; its widgets only rerun this fragment"""
+    st.markdown(f"### {history_title}")
+    
+    # Create a chat container with scrolling
+    chat_container = st.container()
+    
+    with chat_container:
+        for message in st.session_state[history_key]:
+            render_fn(message)
+    
+    # Clear history button
+    if st.session_state[history_key] and st.button("Clear History", key=f"clear_{history_key}"):
+        st.session_state[history_key] = []
+        if on_clear:
+            on_clear()
+        st.rerun()
+
+def run_agent_page(title: str, description: str, examples: List[str], placeholder: str, submit_label: str,
+                   history_key: str, history_title: str, create_agent_fn, run_fn, render_fn,
+                   agent_name: str = "agent", settings_fn=None, on_clear=None):
+    """
+    Runs the shared layout of a single-agent chat page
+    
+    Args:
+        title: The page title
+        description: Markdown shown under the title
+        examples: Example prompts offered in the selectbox
+        placeholder: Placeholder text for the custom prompt
+        submit_label: Label of the submit button
+        history_key: Session state key holding the page's chat history
+        history_title: Heading shown above the chat history
+        create_agent_fn: Called with the API key and the settings; returns (client, agent)
+        run_fn: Called with (client, agent, prompt, history); runs the agent and appends its replies to history
+        render_fn: Called with each history message to render it
+        agent_name: Name shown while the agent is being prepared
+        settings_fn: Optional callable drawing page-specific widgets; returns keyword arguments for create_agent_fn
+        on_clear: Optional callable run when the history is cleared
+    """
+    st.title(title)
+    
+    st.markdown(description)
+    
+    # API key check
+    if not st.session_state.api_key:
+        st.warning("Please enter your Mistral API Key in the sidebar to use this feature.")
+        return
+    
+    # Page-specific options
+    settings = settings_fn() if settings_fn else {}
+    
+    # Select example or custom prompt
+    prompt_type = st.radio(
+        "Choose a prompt type:",
+        ["Example Prompts", "Custom Prompt"],
+        index=0,
+        horizontal=True
+    )
+    
+    if prompt_type == "Example Prompts":
+        user_prompt = st.selectbox("Select an example prompt:", examples)
+    else:
+        user_prompt = st.text_area(
+            "Enter your custom prompt:",
+            placeholder=placeholder,
+            height=100
+        )
+    
+    # Submit button
+    if st.button(submit_label, key=f"{history_key}_submit", type="primary"):
+        if not user_prompt:
+            st.warning("Please enter a prompt.")
+            return
+        
+        with st.spinner(f"Preparing {agent_name}..."):
+            client, agent = create_agent_fn(st.session_state.api_key, **settings)
+        
+        if not client or not agent:
+            return
+        
+        # Add user message to history
+        history = st.session_state.setdefault(history_key, [])
+        history.append({
+            "key": uuid4().hex[:10],
+            "role": "user",
+            "content": user_prompt
+        })
+        
+        run_fn(client, agent, user_prompt, history)
+    
+    # Chat history reruns on its own when its buttons are clicked
+    _agent_history_fragment(history_key, history_title, render_fn, on_clear)
+
+@st.cache_resource(show_spinner=False)
+def _load_api_key() -> str:
+    """Read the default API key from the environment or a .env file once per process"""
+    # Try to load from .env file
+    try:
+        from dotenv import load_dotenv
+        load_dotenv()
+        return os.getenv("MISTRAL_API_KEY", "")
+    except Exception:
+        return ""
+
 # Initialize session state variables if they don't exist
 def init_session_state():
     """Initialize all session state variables if they don't exist"""
@@ -207,21 +453,17 @@ def init_session_state():
     if 'image_generation_history' not in st.session_state:
         st.session_state.image_generation_history = []
     
+    if 'image_blobs' not in st.session_state:
+        st.session_state.image_blobs = OrderedDict()
+    
     if 'web_search_history' not in st.session_state:
         st.session_state.web_search_history = []
     
     if 'orchestration_history' not in st.session_state:
-        st.session_state.orchestration_history = []
+        st.session_state.orchestration_history = deque(maxlen=ORCHESTRATION_HISTORY_LIMIT)
     
     if 'function_calls_history' not in st.session_state:
         st.session_state.function_calls_history = []
     
     if 'api_key' not in st.session_state:
-        # Try to load from .env file
-        try:
-            from dotenv import load_dotenv
-            load_dotenv()
-            api_key = os.getenv("MISTRAL_API_KEY", "")
-            st.session_state.api_key = api_key
-        except:
-            st.session_state.api_key = ""
+        st.session_state.api_key = _load_api_key()